@@ -0,0 +1,230 @@
+##########################################################################
+##
+## Copyright (c) 2017 Carel Combrink
+##
+## This file is part of the Hamster QML GUI, a QML GUI for the hamster-lib.
+##
+## The Hamster QML GUI is free software: you can redistribute it and/or
+## modify it under the terms of the GNU Lesser General Public License as
+## published by the Free Software Foundation, either version 3 of the
+## License, or (at your option) any later version.
+##
+## The Hamster QML GUI is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU Lesser General Public License for more details.
+##
+## You should have received a copy of the GNU Lesser General Public License
+## along with the Hamster QML GUI. If not, see <http://www.gnu.org/licenses/>.
+############################################################################
+"""
+Benchmarks of the Python model layer.
+
+The benchmarks run headless on synthetic databases with the given numbers
+of facts. The databases are generated once and reused. The results are
+written as JSON so that they can be compared between revisions.
+
+Each database is configured by a benchmark.conf in its folder, the
+environment and the hamster_pyqt.conf of the application are not used. The
+benchmark does not run on a database that it did not create.
+
+Usage: python benchmark.py [--sizes 1000,100000,1000000] [--repeat 5]
+                           [--dir benchmark-data] [--output results.json]
+"""
+import os
+import sys
+import json
+import random
+import argparse
+import platform
+import datetime
+import statistics
+import subprocess
+import time
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt5.QtCore import QCoreApplication, QDate, QDateTime, QModelIndex
+
+from hamster_lib.backends.sqlalchemy.objects import AlchemyFact, AlchemyActivity, AlchemyCategory
+
+from hamster_pyqt      import HamsterPyQt, HamsterConfig, FACT_START_OFFSET
+from hamster_backend   import HamsterBackend
+from facts_model       import FactModelPyQt
+from sort_filter_model import SortFilterModelPyQt
+from categories_model  import HqCategoriesModel
+
+CATEGORIES     = 20  # Number of categories in the synthetic databases
+ACTIVITIES     = 200 # Number of activities in the synthetic databases
+INSERT_BATCH   = 50000
+CONFIG_FILE    = 'benchmark.conf'
+CONFIG         = """[hamster]
+db_path = {0}
+tmpfile_path = {1}
+journal_path = {2}
+"""
+
+def makeConfig(folder):
+    """ Write the configuration of the synthetic database in the given folder
+    and read it, without the environment. The configuration is written when the
+    database is created, a folder with a database that is not empty but without
+    a configuration is refused since makeDatabase() replaces its facts. """
+    path     = os.path.join(folder, CONFIG_FILE)
+    database = os.path.join(folder, 'hamster.sqlite')
+    if not os.path.exists(path) and os.path.exists(database) and os.path.getsize(database) > 0:
+        raise RuntimeError('{0} was not created by the benchmark'.format(database))
+    with open(path, 'w') as file:
+        file.write(CONFIG.format(database, os.path.join(folder, 'hamster.fact'),
+                                 os.path.join(folder, 'hamster.journal')))
+    return HamsterConfig(path, environ={})
+
+def makeDatabase(config, facts):
+    """ Create the synthetic database of the configuration with the given
+    number of facts. The facts take 30 minutes with 10 minutes between them,
+    the most recent one ended an hour ago. An existing database with the
+    same number of facts is reused. """
+    backend = HamsterBackend(config)
+    session = backend.control.store.session
+    if session.query(AlchemyFact).count() == facts:
+        return
+    session.query(AlchemyFact).delete()
+    session.query(AlchemyActivity).delete()
+    session.query(AlchemyCategory).delete()
+    session.commit()
+    session.bulk_insert_mappings(AlchemyCategory, [
+        dict(pk=pk, name='category{0}'.format(pk)) for pk in range(1, CATEGORIES + 1) ])
+    session.bulk_insert_mappings(AlchemyActivity, [
+        dict(pk=pk, name='activity{0}'.format(pk), deleted=False, category_id=pk % CATEGORIES + 1)
+        for pk in range(1, ACTIVITIES + 1) ])
+    last  = datetime.datetime.now().replace(second=0, microsecond=0) - datetime.timedelta(hours=1)
+    first = last - datetime.timedelta(minutes=40 * facts)
+    for batch in range(0, facts, INSERT_BATCH):
+        session.bulk_insert_mappings(AlchemyFact, [
+            dict(start=first + datetime.timedelta(minutes=40 * index, seconds=FACT_START_OFFSET),
+                 end=first + datetime.timedelta(minutes=40 * index + 30),
+                 activity_id=index % ACTIVITIES + 1, description='fact {0}'.format(index))
+            for index in range(batch, min(batch + INSERT_BATCH, facts)) ])
+    session.commit()
+    backend.close()
+
+def measure(name, function, repeat, results, size):
+    """ Time the function and add the result. """
+    times = []
+    for run in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append((time.perf_counter() - start) * 1000)
+    results.append(dict(facts=size, name=name, runs=repeat, min_ms=min(times),
+                        median_ms=statistics.median(times), mean_ms=statistics.mean(times)))
+    print('{0:>8} {1:<40} {2:>10.3f} ms'.format(size, name, statistics.median(times)), file=sys.stderr)
+
+def benchmark(config, size, repeat, results):
+    """ Run the benchmarks on the database of the configuration. """
+    rnd     = random.Random(size)
+    hamster = HamsterPyQt(threaded=False, config=config)
+    today   = QDate.currentDate()
+
+    def listFacts():
+        hamster.list(today.addDays(-30).toPyDate(), today.toPyDate(), lambda facts: None)
+    measure('HamsterPyQt.list (30 days)', listFacts, repeat, results, size)
+
+    model = FactModelPyQt(hamster)
+    measure('FactModelPyQt.refreshFacts', model.refreshFacts, repeat, results, size)
+
+    def ensureLoaded():
+        model.refreshFacts()
+        model.ensureLoaded(today.addDays(-90))
+    measure('FactModelPyQt.ensureLoaded (90 days)', ensureLoaded, repeat, results, size)
+
+    def data():
+        index = model.index(rnd.randrange(model.rowCount()), 0)
+        for role in model.roleNames():
+            model.data(index, role)
+    measure('FactModelPyQt.data (all roles)', data, repeat * 100, results, size)
+
+    # New facts are added after the most recent fact.
+    added = [QDateTime.currentDateTime().addSecs(3600)]
+    def addFact():
+        start = added[0]
+        added[0] = start.addSecs(600)
+        hamster.create(start, start.addSecs(300), 'activity1', 'category2', 'added')
+    measure('HamsterPyQt.create + addFact', addFact, repeat * 10, results, size)
+
+    columns = model.columns()
+    def updateFact():
+        row   = rnd.randrange(model.rowCount())
+        start = columns.start(row)
+        hamster.updateFact(columns.keys[row], start, columns.end(row), 'activity3', 'category4', 'updated')
+    measure('HamsterPyQt.updateFact', updateFact, repeat * 10, results, size)
+
+    proxy = SortFilterModelPyQt(None)
+    proxy.sourceModel = model
+    def window():
+        start = today.addDays(-rnd.randrange(90))
+        proxy.startDate = start
+        proxy.endDate   = start.addDays(rnd.randrange(1, 8))
+    measure('SortFilterModelPyQt window', window, repeat * 10, results, size)
+
+    def fetchOlder():
+        proxy.startDate = QDate()
+        proxy.endDate   = QDate()
+        proxy.fetchOlder()
+    measure('SortFilterModelPyQt.fetchOlder', fetchOlder, repeat, results, size)
+
+    categories = HqCategoriesModel(hamster)
+    measure('HqCategoriesModel.refreshCategories', categories.refreshCategories, repeat, results, size)
+
+    names = ['category{0}'.format(pk) for pk in range(1, CATEGORIES + 1)]
+    def activitiesList():
+        categories.refreshCategories()
+        for name in names:
+            categories.activitiesList(name)
+    measure('activitiesList (cold)', activitiesList, repeat, results, size)
+    def activitiesListWarm():
+        for name in names:
+            categories.activitiesList(name)
+    measure('activitiesList (warm)', activitiesListWarm, repeat * 10, results, size)
+    hamster.close()
+
+def revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks of the Python model layer.')
+    parser.add_argument('--sizes', default='1000,100000,1000000',
+                        help='comma separated numbers of facts of the databases')
+    parser.add_argument('--repeat', type=int, default=5, help='number of runs of each benchmark')
+    parser.add_argument('--dir', default='benchmark-data', help='folder for the generated databases')
+    parser.add_argument('--output', help='file to write the JSON results to, default stdout')
+    args = parser.parse_args()
+
+    app     = QCoreApplication(sys.argv)
+    results = []
+    base    = os.path.abspath(args.dir)
+    for size in [int(size) for size in args.sizes.split(',')]:
+        folder = os.path.join(base, str(size))
+        os.makedirs(folder, exist_ok=True)
+        try:
+            config = makeConfig(folder)
+        except RuntimeError as error:
+            parser.exit(1, 'Not running the benchmark: {0}\n'.format(error))
+        start = time.perf_counter()
+        makeDatabase(config, size)
+        print('{0:>8} {1:<40} {2:>10.3f} ms'.format(size, 'generate database',
+                                                  (time.perf_counter() - start) * 1000), file=sys.stderr)
+        benchmark(config, size, args.repeat, results)
+    report = dict(revision=revision(), python=platform.python_version(),
+                  platform=platform.platform(), date=datetime.datetime.now().isoformat(),
+                  results=results)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+if __name__ == '__main__':
+    main()
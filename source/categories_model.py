@@ -19,13 +19,16 @@
 ############################################################################
 
 import sys
-from PyQt5.QtCore import Qt, pyqtSlot, QModelIndex, QByteArray, QVariant
+from bisect import bisect_left
+from PyQt5.QtCore import Qt, pyqtSlot, pyqtSignal, pyqtProperty, QModelIndex, QByteArray, QVariant
 from PyQt5.QtGui  import QStandardItemModel, QStandardItem
 
 from hamster_lib import Fact
 
 from hamster_pyqt import HamsterPyQt
 from hamster_pyqt import FactPyQt
+from hamster_pyqt import HqCategory
+from hamster_pyqt import HqActivity
 
 class HqCategoriesModel(QStandardItemModel):
     """
@@ -35,16 +38,27 @@ class HqCategoriesModel(QStandardItemModel):
     This model allows for the removal of categories and activities if the
     respective item does not have dependents.
     Use the canRemove() function to check if the removeItem() function will
-    remove the item.
+    remove the item. The number of dependents of each item, facts for the
+    activities and activities for the categories, is kept in the model.
+    Categories and activities that are added or removed are inserted or
+    removed as single rows, the model is only reset when it is refreshed.
     """
     COLUMNS = ('name'       ,
                'key'        ,
-               'type'       )
+               'type'       ,
+               'dependents' )
 
-    def __init__(self, hamster):
+    revisionChanged = pyqtSignal(name='revisionChanged')
+
+    def __init__(self, hamster, load = True):
         super(HqCategoriesModel, self).__init__()
         self._hamster      = hamster
-        self._categories   = []
+        self._categoryItems = {} # The name items of the category rows by key
+        self._activityItems = {} # The name items of the activity rows by key
+        self._categoryKeys  = {} # The keys of the categories by name
+        self._activityNames = {} # Sorted activity names and their folded names by category
+                                 # key, created when first used and dropped when changed.
+        self._revision      = 0  # Changes when the categories or activities change
         self._totals       = {} # Day totals maintained in the model. When the model is refreshed this
                                 # list is refreshed. When new facts are added or exising ones updated,
                                 # the totals are updated accordingly.
@@ -53,45 +67,262 @@ class HqCategoriesModel(QStandardItemModel):
         self._rName        = roleIndexes; roleIndexes += 1
         self._rKey         = roleIndexes; roleIndexes += 1
         self._rType        = roleIndexes; roleIndexes += 1
+        self._rDependents  = roleIndexes; roleIndexes += 1
         # Reset the index to reuse
         roleIndexes      = 0
         self._roles[self._rName       ] = QByteArray().append(HqCategoriesModel.COLUMNS[roleIndexes]); roleIndexes += 1
         self._roles[self._rKey        ] = QByteArray().append(HqCategoriesModel.COLUMNS[roleIndexes]); roleIndexes += 1
         self._roles[self._rType       ] = QByteArray().append(HqCategoriesModel.COLUMNS[roleIndexes]); roleIndexes += 1
+        self._roles[self._rDependents ] = QByteArray().append(HqCategoriesModel.COLUMNS[roleIndexes]); roleIndexes += 1
+
+        if load:
+            self.refreshCategories()
+        self._hamster.categoryAdded.connect(self.addCategoryItem)
+        self._hamster.categoryRemoved.connect(self.removeCategoryItem)
+        self._hamster.activityAdded.connect(self.addActivityItem)
+        self._hamster.activityRemoved.connect(self.removeActivityItem)
+        # Facts can create activities and categories when they are saved.
+        self._hamster.factAdded.connect(self._factAdded)
+        self._hamster.factUpdated.connect(self._factUpdated)
+        # Imports can create many activities, load them all again.
+        self._hamster.factsImported.connect(self.refreshCategories)
+        # Changes of other applications, see HamsterPyQt.syncChanges().
+        self._hamster.categoriesSynced.connect(self._syncCategories)
+        self._hamster.factsChanged.connect(self._factsChanged)
+
+    def _row(self, name, key, type, dependents):
+        # The items of a row in the model.
+        return [ QStandardItem( name ), QStandardItem( str(key) ), QStandardItem( type ),
+                 QStandardItem( str(dependents) ) ]
+
+    def _dependentsItem(self, item):
+        # The dependents item in the row of the name item.
+        parent = item.parent() or self.invisibleRootItem()
+        return parent.child( item.row(), 3 )
 
-        self.refreshCategories()
-        self._hamster.categoriesChanged.connect(self.refreshCategories)
-        self._hamster.activitiesChanged.connect(self.refreshCategories)
+    def _addDependents(self, item, count):
+        dependents = self._dependentsItem( item )
+        dependents.setText( str( int( dependents.text() ) + count ) )
+
+    def _changed(self):
+        self._revision += 1
+        self.revisionChanged.emit()
+
+    @pyqtProperty(int, notify=revisionChanged)
+    def revision(self):
+        """ Changes each time categories or activities are added, removed or
+        renamed. QML bindings that use activitiesList() can depend on it to be
+        updated when the lists change. """
+        return self._revision
 
     @pyqtSlot()
     def refreshCategories(self):
+        """ Load all the categories and activities again. """
+        self._hamster.categories(self._categoriesLoaded)
+
+    def _categoriesLoaded(self, categories):
         self.beginResetModel()
-        self._categories = self._hamster.categories()
         parent = self.invisibleRootItem()
         parent.removeRows(0, parent.rowCount() )
-        for cat in self._categories.values():
-            item = QStandardItem( cat.name() )
-            parent.appendRow( [ item, QStandardItem( str(cat.key()) ), QStandardItem( "Category" ) ] )
+        self._categoryItems = {}
+        self._activityItems = {}
+        self._categoryKeys  = {}
+        self._activityNames = {}
+        for cat in categories.values():
+            item = self._row( cat.name(), cat.key(), "Category", cat.dependents() )
+            parent.appendRow( item )
+            self._categoryItems[ cat.key() ] = item[0]
+            self._categoryKeys[ cat.name() ] = cat.key()
             for act in cat.activities():
-                item.appendRow( [ QStandardItem( act.name() ), QStandardItem( str(act.key()) ), QStandardItem( "Activity" ) ] )
+                actItem = self._row( act.name(), act.key(), "Activity", act.dependents() )
+                item[0].appendRow( actItem )
+                self._activityItems[ act.key() ] = actItem[0]
         self.endResetModel()
+        self._changed()
+
+    @pyqtSlot()
+    def _syncCategories(self):
+        self._hamster.categories(self._categoriesSynced)
+
+    def _setText(self, item, text):
+        # Only change the item if the text changed, to prevent needless updates.
+        if item.text() != text:
+            item.setText(text)
+
+    def _categoriesSynced(self, categories):
+        """ Apply the differences between the loaded categories and the model.
+
+        Categories and activities that are no longer there are removed, new
+        ones are added, renamed ones are updated and activities that moved to
+        another category are moved. The model is not reset.
+        """
+        categoryKeys = set( cat.key() for cat in categories.values() )
+        activities   = [ act for cat in categories.values() for act in cat.activities() ]
+        activityKeys = set( act.key() for act in activities )
+        renamed      = False # Added and removed items report their change themselves
+        for key in [ key for key in self._activityItems if key not in activityKeys ]:
+            self.removeActivityItem( key )
+        for key in [ key for key in self._categoryItems if key not in categoryKeys ]:
+            self.removeCategoryItem( key )
+        for cat in categories.values():
+            item = self._categoryItems.get( cat.key() )
+            if item is None:
+                self.addCategoryItem( cat )
+                continue
+            if item.text() != cat.name():
+                self._categoryKeys.pop( item.text(), None )
+                self._categoryKeys[ cat.name() ] = cat.key()
+                item.setText( cat.name() )
+                renamed = True
+        for act in activities:
+            item = self._activityItems.get( act.key() )
+            if item is not None and self._itemKey( item.parent() ) != act.categoryKey():
+                self.removeActivityItem( act.key() )
+                item = None
+            if item is None:
+                self.addActivityItem( act )
+                item = self._activityItems[ act.key() ]
+            elif item.text() != act.name():
+                self._activityNames.pop( act.categoryKey(), None )
+                item.setText( act.name() )
+                renamed = True
+            self._setText( self._dependentsItem( item ), str( act.dependents() ) )
+        for cat in categories.values():
+            self._setText( self._dependentsItem( self._categoryItems[ cat.key() ] ), str( cat.dependents() ) )
+        if renamed:
+            self._changed()
+
+    @pyqtSlot(object, object)
+    def _factsChanged(self, rows, removed):
+        # The facts of other applications can add activities, which are
+        # reported with categoriesSynced, and change the dependents.
+        self._hamster.dependencyCounts( self._countsLoaded )
+
+    @pyqtSlot(HqCategory)
+    def addCategoryItem(self, category):
+        """ Add a row for the category if it is not in the model yet. """
+        if category.key() in self._categoryItems:
+            return
+        item = self._row( category.name(), category.key(), "Category", category.dependents() )
+        self._categoryItems[ category.key() ] = item[0]
+        self._categoryKeys[ category.name() ] = category.key()
+        self.invisibleRootItem().appendRow( item )
+        self._changed()
+
+    @pyqtSlot(int)
+    def removeCategoryItem(self, key):
+        """ Remove the row of the category, with the rows of its activities. """
+        item = self._categoryItems.pop( key, None )
+        if item is None:
+            return
+        self._categoryKeys.pop( item.text(), None )
+        self._activityNames.pop( key, None )
+        for row in range( item.rowCount() ):
+            self._activityItems.pop( int(item.child(row, 1).text()), None )
+        self.invisibleRootItem().removeRow( item.row() )
+        self._changed()
+
+    @pyqtSlot(HqActivity)
+    def addActivityItem(self, activity):
+        """ Add a row for the activity if it is not in the model yet. The
+        category of the activity is added as well if needed. """
+        if activity.key() in self._activityItems:
+            return
+        if activity.categoryKey() not in self._categoryItems:
+            self.addCategoryItem( activity.category() )
+        item = self._row( activity.name(), activity.key(), "Activity", activity.dependents() )
+        self._activityItems[ activity.key() ] = item[0]
+        self._activityNames.pop( activity.categoryKey(), None )
+        category = self._categoryItems[ activity.categoryKey() ]
+        category.appendRow( item )
+        self._addDependents( category, 1 )
+        self._changed()
+
+    @pyqtSlot(int)
+    def removeActivityItem(self, key):
+        """ Remove the row of the activity. """
+        item = self._activityItems.pop( key, None )
+        if item is None:
+            return
+        category = item.parent()
+        self._activityNames.pop( self._itemKey( category ), None )
+        category.removeRow( item.row() )
+        self._addDependents( category, -1 )
+        self._changed()
+
+    def _factActivity(self, fact):
+        # The item of the activity of the fact, the activity is added if
+        # the fact created it.
+        activity = fact.fact().activity
+        if activity.pk is None:
+            return None
+        if activity.pk not in self._activityItems:
+            self.addActivityItem( HqActivity(activity) )
+        return self._activityItems[ activity.pk ]
+
+    @pyqtSlot(FactPyQt)
+    def _factAdded(self, fact):
+        item = self._factActivity( fact )
+        if item is not None:
+            self._addDependents( item, 1 )
+
+    @pyqtSlot(FactPyQt)
+    def _factUpdated(self, fact):
+        # The previous activity of the fact is not known, count the
+        # dependents again.
+        self._factActivity( fact )
+        self._hamster.dependencyCounts( self._countsLoaded )
+
+    def _countsLoaded(self, counts):
+        facts, activities = counts
+        for key, item in self._activityItems.items():
+            self._dependentsItem( item ).setText( str( facts.get( key, 0 ) ) )
+        for key, item in self._categoryItems.items():
+            self._dependentsItem( item ).setText( str( activities.get( key, 0 ) ) )
+
+    def _itemKey(self, item):
+        # The key of the item, from the key column of its row.
+        parent = item.parent() or self.invisibleRootItem()
+        return int( parent.child( item.row(), 1 ).text() )
+
+    def _names(self, category):
+        # The sorted activity names and folded names of the category with the
+        # given name, the empty name is used for uncategorised activities.
+        key = self._categoryKeys.get( category, -1 ) if category != '' else -1
+        names = self._activityNames.get( key )
+        if names is None:
+            item       = self._categoryItems.get( key )
+            activities = []
+            if item is not None:
+                activities = [ item.child(row, 0).text() for row in range( item.rowCount() ) ]
+            activities.sort( key=str.casefold )
+            names = ( [''] + activities, [ name.casefold() for name in activities ] )
+            self._activityNames[ key ] = names
+        return names
 
     @pyqtSlot(str,result=QVariant)
     def activitiesList(self, category):
       """
-      Get the list of activities for the given category. The
+      Get the sorted list of activities for the given category. The
       first item in the list will (for now) always be an empty string.
+      The lists are cached until the activities of the category change.
       """
-      list = ['']
-      cat = self._categories[ None ]
-      if category is not '':
-        for tmpCategory in self._categories.values():
-          if tmpCategory.name() == category:
-            cat = tmpCategory
-            break
-      for act in cat.activities():
-        list.append( act.name() )
-      return list
+      return self._names( category )[0]
+
+    @pyqtSlot(str, str, result=QVariant)
+    def activitiesWithPrefix(self, category, prefix):
+      """
+      Get the sorted list of activities of the given category whose
+      names start with the prefix, ignoring the case.
+      """
+      names, folded = self._names( category )
+      prefix = prefix.casefold()
+      first  = bisect_left( folded, prefix )
+      last   = first
+      while last < len( folded ) and folded[last].startswith( prefix ):
+        last += 1
+      # The names list starts with the empty string
+      return names[first + 1:last + 1]
 
     def roleNames(self):
         return self._roles
@@ -103,6 +334,7 @@ class HqCategoriesModel(QStandardItemModel):
         if   role == self._rName: col = 0
         elif role == self._rKey : col = 1
         elif role == self._rType: col = 2
+        elif role == self._rDependents: col = 3
         return QStandardItemModel.data(self, index.siblingAtColumn( col ), Qt.DisplayRole)
 
     @pyqtSlot(QModelIndex)
@@ -115,16 +347,17 @@ class HqCategoriesModel(QStandardItemModel):
 
     @pyqtSlot(QModelIndex, result=bool)
     def canRemove(self, index):
+      """ Items can be removed if they do not have dependents, the
+      uncategorised node can not be removed. """
       type = index.data(self._rType)
-      if type == 'Category':
-        return self._hamster.canRemoveCategory(index.data(self._rKey))
-      if type == "Activity":
-        return self._hamster.canRemoveActivity(index.data(self._rKey))
-      return False
+      if type not in ('Category', 'Activity'):
+        return False
+      if type == 'Category' and int(index.data(self._rKey)) == -1:
+        return False
+      return int(index.data(self._rDependents)) == 0
 
     @pyqtSlot(str, str)
     def addActivity(self, activity, category):
-      added = self._hamster.addActivity( activity, category )
-      if added:
-        self.refreshCategories()
+      # The rows are added when the activity is added
+      self._hamster.addActivity( activity, category )
 
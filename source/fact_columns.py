@@ -0,0 +1,203 @@
+##########################################################################
+##
+## Copyright (c) 2017 Carel Combrink
+##
+## This file is part of the Hamster QML GUI, a QML GUI for the hamster-lib.
+##
+## The Hamster QML GUI is free software: you can redistribute it and/or
+## modify it under the terms of the GNU Lesser General Public License as
+## published by the Free Software Foundation, either version 3 of the
+## License, or (at your option) any later version.
+##
+## The Hamster QML GUI is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU Lesser General Public License for more details.
+##
+## You should have received a copy of the GNU Lesser General Public License
+## along with the Hamster QML GUI. If not, see <http://www.gnu.org/licenses/>.
+############################################################################
+
+
+import sys
+import datetime
+from array import array
+from bisect import bisect_left, bisect_right
+from operator import itemgetter, gt
+
+from PyQt5.QtCore import QDate, QDateTime
+
+# Difference between the ordinal of a Python date and the Julian day of a QDate
+JULIAN_DAY_OFFSET = 1721425
+
+def dateToDay(date):
+    """ Convert a Python date or QDate to the day number used in the columns. """
+    if isinstance(date, QDate):
+        return date.toJulianDay() - JULIAN_DAY_OFFSET
+    return date.toordinal()
+
+def dayToQDate(day):
+    """ Convert a day number used in the columns to a QDate. """
+    return QDate.fromJulianDay(day + JULIAN_DAY_OFFSET)
+
+class FactColumns():
+    """ Columnar storage for facts.
+
+    The values of the facts are kept in parallel arrays instead of keeping an
+    object for each fact. Times are stored as seconds since the epoch and the
+    day of a fact (the day it ended) as the ordinal of the date. The strings
+    are interned so that facts with the same activity, category or
+    description share the same string.
+
+    The facts are kept in the order of their start times. Since facts do not
+    overlap, the days are in order as well and the facts of a range of days
+    are found using a binary search, see dayRows(). Databases written by
+    other applications can contain overlapping facts, the rows that end
+    before the row before them are counted and while there are any the
+    facts are found by a linear scan instead, see ordered.
+    """
+
+    COLUMNS = ('keys', 'starts', 'ends', 'durations', 'days', 'activities', 'categories', 'descriptions')
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.keys         = array('q')
+        self.starts       = array('q')
+        self.ends         = array('q')
+        self.durations    = array('q') # Seconds from the start to the end
+        self.days         = array('l')
+        self.activities   = []
+        self.categories   = []
+        self.descriptions = []
+        self._unordered   = 0 # Rows that end before the row before them
+
+    def __len__(self):
+        return len(self.keys)
+
+    @staticmethod
+    def values(key, start, end, activity, category, description):
+        """ Get the column values for a fact, the start and end are Python datetimes. """
+        startSecs = int(start.timestamp())
+        endSecs   = int(end.timestamp())
+        return (key, startSecs, endSecs, endSecs - startSecs, end.toordinal(),
+                sys.intern(activity), sys.intern(category or ""), sys.intern(description or ""))
+
+    @staticmethod
+    def factValues(fact):
+        """ Get the column values for a hamster-lib fact. """
+        category = fact.category.name if fact.category else ""
+        return FactColumns.values(fact.pk, fact.start, fact.end, fact.activity.name, category, fact.description)
+
+    @staticmethod
+    def sortedValues(rows):
+        """ Get the column values for rows of (key, start, end, activity, category,
+        description), in the order of the start times.
+
+        Rows that are already in order, like the rows from the backend, are
+        sorted in linear time. Sorting them here guarantees the order of the
+        columns without depending on the order of the backend.
+        """
+        values = [FactColumns.values(*row) for row in rows]
+        values.sort(key=itemgetter(1))
+        return values
+
+    @property
+    def ordered(self):
+        """ Are the ends, and so the days, of the facts in order? This is the
+        case if the facts do not overlap. """
+        return self._unordered == 0
+
+    def _descents(self, first, last):
+        # The number of rows from first up to and including last that end
+        # before the row before them.
+        first = max(first, 1)
+        last  = min(last, len(self.ends) - 1)
+        if first > last:
+            return 0
+        return sum(map(gt, self.ends[first - 1:last], self.ends[first:last + 1]))
+
+    def set(self, row, values):
+        """ Set the fact in the given row to the given column values. """
+        self._unordered -= self._descents(row, row + 1)
+        for name, value in zip(FactColumns.COLUMNS, values):
+            getattr(self, name)[row] = value
+        self._unordered += self._descents(row, row + 1)
+
+    def get(self, row):
+        """ Get the column values of the fact in the given row. """
+        return tuple(getattr(self, name)[row] for name in FactColumns.COLUMNS)
+
+    def insert(self, row, facts):
+        """ Insert the facts, given as a list of column values, before the given row. """
+        self._unordered -= self._descents(row, row)
+        for column, name in enumerate(FactColumns.COLUMNS):
+            values = getattr(self, name)
+            inserted = [fact[column] for fact in facts]
+            if isinstance(values, array):
+                inserted = array(values.typecode, inserted)
+            values[row:row] = inserted
+        self._unordered += self._descents(row, row + len(facts))
+
+    def remove(self, row):
+        """ Remove the fact in the given row. """
+        self._unordered -= self._descents(row, row + 1)
+        for name in FactColumns.COLUMNS:
+            del getattr(self, name)[row]
+        self._unordered += self._descents(row, row)
+
+    def insertRow(self, start):
+        """ The row at which a fact with the given start must be inserted. """
+        return bisect_right(self.starts, start)
+
+    def findRow(self, key, start):
+        """ Find the row of the fact with the given key and start, None if it
+        is not in the columns. """
+        row = bisect_left(self.starts, start)
+        while row < len(self.keys) and self.starts[row] == start:
+            if self.keys[row] == key:
+                return row
+            row += 1
+        return None
+
+    def overlaps(self, start, end, key = None):
+        """ Get the rows of the facts that overlap the time from start up to
+        end, in seconds since the epoch. The fact with the given key is left
+        out, it is the fact that is being changed.
+
+        Since the facts do not overlap each other their ends are in order as
+        well, the facts that overlap are the range of rows from the first fact
+        that ends after the start up to the last fact that starts before the
+        end. The range is found with a binary search. """
+        if not self.ordered:
+            last = bisect_left(self.starts, end)
+            return [row for row in range(last) if self.ends[row] > start and self.keys[row] != key]
+        first = bisect_right(self.ends, start)
+        last  = bisect_left(self.starts, end, first)
+        return [row for row in range(first, last) if self.keys[row] != key]
+
+    def dayRows(self, firstDay = None, lastDay = None):
+        """ Get the range of rows, as (first, end), for the facts of the days from
+        the first day up to and including the last day. Both days are day numbers
+        and are optional; a missing day leaves that side of the range open.
+
+        If the days are not in order the range is found by a linear scan, it
+        is the smallest range that contains all the facts of the days and can
+        contain facts of other days as well. """
+        if not self.ordered:
+            rows = [row for row, day in enumerate(self.days)
+                    if (firstDay is None or day >= firstDay) and (lastDay is None or day <= lastDay)]
+            return (rows[0], rows[-1] + 1) if rows else (0, 0)
+        first = bisect_left(self.days, firstDay) if firstDay is not None else 0
+        end   = bisect_right(self.days, lastDay) if lastDay is not None else len(self.days)
+        return (first, max(first, end))
+
+    def start(self, row):
+        return QDateTime.fromSecsSinceEpoch(self.starts[row])
+
+    def end(self, row):
+        return QDateTime.fromSecsSinceEpoch(self.ends[row])
+
+    def day(self, row):
+        return dayToQDate(self.days[row])
@@ -0,0 +1,107 @@
+##########################################################################
+##
+## Copyright (c) 2017 Carel Combrink
+##
+## This file is part of the Hamster QML GUI, a QML GUI for the hamster-lib.
+##
+## The Hamster QML GUI is free software: you can redistribute it and/or
+## modify it under the terms of the GNU Lesser General Public License as
+## published by the Free Software Foundation, either version 3 of the
+## License, or (at your option) any later version.
+##
+## The Hamster QML GUI is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU Lesser General Public License for more details.
+##
+## You should have received a copy of the GNU Lesser General Public License
+## along with the Hamster QML GUI. If not, see <http://www.gnu.org/licenses/>.
+############################################################################
+import io
+import os
+import csv
+import json
+import datetime
+
+# The columns that are exported, the same columns are read by fact_import.
+COLUMNS = ('start', 'end', 'activity', 'category', 'description')
+
+# The formats that facts can be written in, by file extension.
+FORMATS = {
+    '.csv'  : 'csv',
+    '.tsv'  : 'tsv',
+    '.jsonl': 'jsonl',
+    '.ics'  : 'ical',
+}
+
+def fileFormat(path):
+    """ Get the format of the file from its extension, 'csv' when unknown. """
+    return FORMATS.get(os.path.splitext(path)[1].lower(), 'csv')
+
+def _values(row):
+    # The exported values of a fact row of (key, start, end, activity, category, description).
+    return (row[1].isoformat(), row[2].isoformat(), row[3], row[4] or '', row[5] or '')
+
+def writeDelimited(rows, delimiter):
+    """ Write the facts as delimited lines with a header. """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=delimiter, lineterminator='\n')
+    writer.writerow(COLUMNS)
+    for row in rows:
+        writer.writerow(_values(row))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    # The header when there are no facts
+    yield buffer.getvalue()
+
+def writeJsonLines(rows):
+    """ Write the facts as JSON objects, one per line. """
+    for row in rows:
+        yield json.dumps(dict(zip(COLUMNS, _values(row)))) + '\n'
+
+def icalEscape(text):
+    """ Escape an iCal text value. """
+    return text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+def icalTime(time):
+    """ Format a local date-time for iCal, without a time zone. """
+    return time.strftime('%Y%m%dT%H%M%S')
+
+def _icalLine(line):
+    # Fold the content line at 75 characters, the next lines start with a space.
+    folded = [line[:75]]
+    for index in range(75, len(line), 74):
+        folded.append(' ' + line[index:index + 74])
+    return '\r\n'.join(folded) + '\r\n'
+
+def writeIcal(rows):
+    """ Write the facts as the events of an iCal calendar. The summary of the
+    events is 'activity@category'. """
+    stamp = datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
+    yield 'BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//hamster-qml//EN\r\n'
+    for row in rows:
+        summary = row[3] + ('@' + row[4] if row[4] else '')
+        yield ''.join((
+            'BEGIN:VEVENT\r\n',
+            _icalLine('UID:{0}@hamster-qml'.format(row[0])),
+            _icalLine('DTSTAMP:' + stamp),
+            _icalLine('DTSTART:' + icalTime(row[1])),
+            _icalLine('DTEND:' + icalTime(row[2])),
+            _icalLine('SUMMARY:' + icalEscape(summary)),
+            _icalLine('DESCRIPTION:' + icalEscape(row[5] or '')),
+            'END:VEVENT\r\n'))
+    yield 'END:VCALENDAR\r\n'
+
+def writeFacts(rows, format):
+    """ Write the fact rows in the given format.
+
+    The rows are tuples of (key, start, end, activity, category, description),
+    the text is generated lazily, a part per fact, so that any number of facts
+    can be written. A ValueError is raised for an unknown format.
+    """
+    if format == 'csv'  : return writeDelimited(rows, ',')
+    if format == 'tsv'  : return writeDelimited(rows, '\t')
+    if format == 'jsonl': return writeJsonLines(rows)
+    if format == 'ical' : return writeIcal(rows)
+    raise ValueError('Unknown export format: {0}'.format(format))
@@ -0,0 +1,213 @@
+##########################################################################
+##
+## Copyright (c) 2017 Carel Combrink
+##
+## This file is part of the Hamster QML GUI, a QML GUI for the hamster-lib.
+##
+## The Hamster QML GUI is free software: you can redistribute it and/or
+## modify it under the terms of the GNU Lesser General Public License as
+## published by the Free Software Foundation, either version 3 of the
+## License, or (at your option) any later version.
+##
+## The Hamster QML GUI is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU Lesser General Public License for more details.
+##
+## You should have received a copy of the GNU Lesser General Public License
+## along with the Hamster QML GUI. If not, see <http://www.gnu.org/licenses/>.
+############################################################################
+import math
+import heapq
+from bisect import bisect_left, insort
+
+from PyQt5.QtCore import QObject, QVariant, pyqtProperty, pyqtSignal, pyqtSlot
+
+from hamster_pyqt import FactPyQt
+
+# The last key that starts with a prefix is less than the prefix followed by
+# the largest character.
+LAST_CHARACTER = chr(0x10ffff)
+
+class PrefixIndex():
+    """
+    Index of values by the prefixes of their keys, ranked by use.
+
+    Each value has one or more keys that are matched ignoring the case. The
+    keys are kept in a sorted list, the keys that start with a prefix are
+    found by bisection. The values are also kept ordered by their rank, a
+    prefix that matches many keys is answered by taking the best ranked
+    values until enough of them match, without looking at the others.
+
+    The rank combines the number of uses and the time of the last use,
+    recent uses count more than old ones: a value is ranked the same as a
+    value used twice as often HALF_LIFE days before. The rank does not
+    depend on the current time, so that it only has to change when the value
+    is used.
+    """
+    HALF_LIFE = 14  # days
+    SCAN      = 256 # Prefixes that match less keys than this are ranked directly
+
+    def __init__(self):
+        self._keys   = [] # (folded key, id), sorted
+        self._ranked = [] # (-rank, id), sorted
+        self._ids    = {} # value -> id
+        self._values = [] # id -> [value, folded keys, count, last, rank]
+
+    def __len__(self):
+        return len(self._values)
+
+    @staticmethod
+    def rank(count, last):
+        """ The rank of a value used count times, last at the given datetime. """
+        day = last.toordinal() + (last.hour * 3600 + last.minute * 60 + last.second) / 86400
+        return math.log2(count) + day / PrefixIndex.HALF_LIFE
+
+    def _use(self, value, keys, count, last):
+        # Add the uses to the entry of the value, returns its id and the new keys.
+        id = self._ids.get(value)
+        if id is None:
+            id = len(self._values)
+            self._ids[value] = id
+            self._values.append([value, [], 0, last, None])
+        entry = self._values[id]
+        added = []
+        for key in keys:
+            key = key.casefold()
+            if key not in entry[1]:
+                entry[1].append(key)
+                added.append(key)
+        entry[2] += count
+        entry[3]  = max(entry[3], last)
+        return id, added
+
+    def add(self, value, keys, count, last):
+        """ Add uses of the value with the given keys, the keys are added to
+        the keys the value already has. The last use is a datetime. """
+        id, added = self._use(value, keys, count, last)
+        entry = self._values[id]
+        for key in added:
+            insort(self._keys, (key, id))
+        if entry[4] is not None:
+            del self._ranked[bisect_left(self._ranked, (-entry[4], id))]
+        entry[4] = PrefixIndex.rank(entry[2], entry[3])
+        insort(self._ranked, (-entry[4], id))
+
+    def extend(self, uses):
+        """ Add many uses, given as (value, keys, count, last), see add().
+        The index is sorted once instead of for each use. """
+        for value, keys, count, last in uses:
+            self._use(value, keys, count, last)
+        for entry in self._values:
+            entry[4] = PrefixIndex.rank(entry[2], entry[3])
+        self._keys   = sorted((key, id) for id, entry in enumerate(self._values) for key in entry[1])
+        self._ranked = sorted((-entry[4], id) for id, entry in enumerate(self._values))
+
+    def find(self, prefix, count):
+        """ Get the best ranked values with a key that starts with the prefix. """
+        prefix = prefix.casefold()
+        first  = bisect_left(self._keys, (prefix,))
+        last   = bisect_left(self._keys, (prefix + LAST_CHARACTER,))
+        if last - first <= PrefixIndex.SCAN:
+            ids = set(id for key, id in self._keys[first:last])
+            ids = heapq.nsmallest(count, ids, key=lambda id: -self._values[id][4])
+        else:
+            ids = []
+            for rank, id in self._ranked:
+                if any(key.startswith(prefix) for key in self._values[id][1]):
+                    ids.append(id)
+                    if len(ids) == count:
+                        break
+        return [self._values[id][0] for id in ids]
+
+
+class HqFactHistory(QObject):
+    """
+    Completion of facts from the history of the facts.
+
+    The activity@category pairs are completed from the start of the name of
+    the activity or of the category, the descriptions from their start. Both
+    are ranked by how often and how recently they were used, see PrefixIndex.
+    The history is loaded from the storage once and is updated with each fact
+    that is added.
+    """
+
+    changed = pyqtSignal(name='changed')
+
+    def __init__(self, hamster, load = True):
+        super(HqFactHistory, self).__init__()
+        self._hamster      = hamster
+        self._activities   = PrefixIndex() # (activity, category)
+        self._descriptions = PrefixIndex() # description
+        self._pairs        = {}            # description -> (activity, category) last used with
+        self._loading      = 0             # Number of loads requested that did not finish
+        self._hamster.factAdded.connect(self._factAdded)
+        self._hamster.factsImported.connect(self.refresh)
+        if load:
+            self.refresh()
+
+    @pyqtSlot()
+    def refresh(self):
+        """ Load the history from the storage. """
+        self._loading += 1
+        self._hamster.history(self._historyLoaded)
+
+    def _historyLoaded(self, rows):
+        self._loading -= 1
+        if self._loading:
+            # A newer load was requested, it includes these rows.
+            return
+        self._activities   = PrefixIndex()
+        self._descriptions = PrefixIndex()
+        self._pairs        = {}
+        activities   = []
+        descriptions = []
+        # Sorted by the last use, the description keeps the most recent pair.
+        for activity, category, description, count, last in sorted(rows, key=lambda row: row[4]):
+            category = category or ''
+            activities.append(((activity, category), (activity, category), count, last))
+            if description:
+                descriptions.append((description, (description,), count, last))
+                self._pairs[description] = (activity, category)
+        self._activities.extend(activities)
+        self._descriptions.extend(descriptions)
+        self.changed.emit()
+
+    def _add(self, activity, category, description, count, last):
+        self._activities.add((activity, category), (activity, category), count, last)
+        if description:
+            self._descriptions.add(description, (description,), count, last)
+            self._pairs[description] = (activity, category)
+
+    @pyqtSlot(FactPyQt)
+    def _factAdded(self, fact):
+        # Requests are handled in order, facts added while loading were
+        # stored before the history was read.
+        if self._loading:
+            return
+        self._add(fact.activity(), fact.category(), fact.description(), 1, fact.fact().start)
+        self.changed.emit()
+
+    @pyqtProperty(int, notify=changed)
+    def size(self):
+        """ The number of activities and descriptions in the history. """
+        return len(self._activities) + len(self._descriptions)
+
+    @pyqtSlot(str, int, result=QVariant)
+    def activities(self, prefix, count):
+        """ Get the best ranked activity@category pairs of which the activity
+        or the category starts with the prefix, ignoring the case. """
+        return QVariant([ dict(activity=activity, category=category,
+                               text='{0}@{1}'.format(activity, category))
+                          for activity, category in self._activities.find(prefix, count) ])
+
+    @pyqtSlot(str, int, result=QVariant)
+    def descriptions(self, prefix, count):
+        """ Get the best ranked descriptions that start with the prefix,
+        ignoring the case, with the activity and category they were last
+        used with. """
+        result = []
+        for description in self._descriptions.find(prefix, count):
+            activity, category = self._pairs[description]
+            result.append(dict(description=description, activity=activity, category=category))
+        return QVariant(result)
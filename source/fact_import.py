@@ -0,0 +1,158 @@
+##########################################################################
+##
+## Copyright (c) 2017 Carel Combrink
+##
+## This file is part of the Hamster QML GUI, a QML GUI for the hamster-lib.
+##
+## The Hamster QML GUI is free software: you can redistribute it and/or
+## modify it under the terms of the GNU Lesser General Public License as
+## published by the Free Software Foundation, either version 3 of the
+## License, or (at your option) any later version.
+##
+## The Hamster QML GUI is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU Lesser General Public License for more details.
+##
+## You should have received a copy of the GNU Lesser General Public License
+## along with the Hamster QML GUI. If not, see <http://www.gnu.org/licenses/>.
+############################################################################
+import os
+import csv
+import json
+import datetime
+
+from hamster_lib import Fact
+
+# The formats that facts can be read from, by file extension.
+FORMATS = {
+    '.txt'  : 'hamster',
+    '.csv'  : 'csv',
+    '.tsv'  : 'tsv',
+    '.jsonl': 'jsonl',
+    '.ics'  : 'ical',
+}
+
+def fileFormat(path):
+    """ Get the format of the file from its extension, 'hamster' when unknown. """
+    return FORMATS.get(os.path.splitext(path)[1].lower(), 'hamster')
+
+def parseTime(text):
+    """ Parse an ISO 8601 date and time, as written by datetime.isoformat(). """
+    return datetime.datetime.fromisoformat(text.strip())
+
+def _record(start, end, activity, category, description):
+    # The facts are read as tuples of (start, end, activity, category, description).
+    return (start, end, activity.strip(), (category or '').strip(), (description or '').strip())
+
+def _parse(parse, item):
+    # Parse an item into a record, None if the item is not valid so that
+    # the reading can continue with the next item.
+    try:
+        return parse(item)
+    except (KeyError, ValueError, TypeError, AttributeError):
+        return None
+
+def rawFact(command):
+    """ Create a hamster-lib fact from a raw fact as it is entered in the
+    application. A comma without an @ starts the description, the activity
+    then has no category. """
+    if ( ',' in command ) and ( not '@' in command ):
+        command = command.replace( ',', '@,' )
+    return Fact.create_from_raw_fact(command)
+
+def _hamsterRecord(line):
+    fact = rawFact(line)
+    return _record(fact.start, fact.end, fact.activity.name,
+                   fact.category.name if fact.category else '', fact.description)
+
+def _itemRecord(item):
+    return _record(parseTime(item['start']), parseTime(item['end']), item['activity'],
+                   item.get('category'), item.get('description'))
+
+def readHamster(lines):
+    """ Read facts in the raw fact format, one per line:
+    '<start> - <end> activity@category, description', see rawFact(). """
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            yield _parse(_hamsterRecord, line)
+
+def readDelimited(lines, delimiter):
+    """ Read facts from delimited lines with a header that contains the
+    columns start, end, activity, category and description. """
+    for row in csv.DictReader(lines, delimiter=delimiter):
+        yield _parse(_itemRecord, row)
+
+def readJsonLines(lines):
+    """ Read facts from JSON objects, one per line, with the keys start, end,
+    activity, category and description. """
+    for line in lines:
+        if line.strip():
+            yield _parse(lambda line: _itemRecord(json.loads(line)), line)
+
+def _icalUnfold(lines):
+    # Lines that start with white space continue the previous line.
+    current = None
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if line[:1] in (' ', '\t') and current is not None:
+            current += line[1:]
+            continue
+        if current is not None:
+            yield current
+        current = line
+    if current is not None:
+        yield current
+
+def icalUnescape(text):
+    """ Undo the escaping of iCal text values. """
+    result = []
+    chars  = iter(text)
+    for char in chars:
+        if char == '\\':
+            char = next(chars, '')
+            char = '\n' if char in ('n', 'N') else char
+        result.append(char)
+    return ''.join(result)
+
+def icalTime(text):
+    """ Parse an iCal date-time, UTC times are converted to local time. """
+    if text.endswith('Z'):
+        utc = datetime.datetime.strptime(text, '%Y%m%dT%H%M%SZ').replace(tzinfo=datetime.timezone.utc)
+        return utc.astimezone().replace(tzinfo=None)
+    return datetime.datetime.strptime(text, '%Y%m%dT%H%M%S')
+
+def _eventRecord(event):
+    activity, _, category = icalUnescape(event.get('SUMMARY', '')).partition('@')
+    return _record(icalTime(event['DTSTART']), icalTime(event['DTEND']), activity,
+                   category, icalUnescape(event.get('DESCRIPTION', '')))
+
+def readIcal(lines):
+    """ Read facts from the events of an iCal calendar. The summary of the
+    events is 'activity@category'. """
+    event = None
+    for line in _icalUnfold(lines):
+        name, _, value = line.partition(':')
+        name = name.split(';')[0].upper()
+        if name == 'BEGIN' and value == 'VEVENT':
+            event = {}
+        elif name == 'END' and value == 'VEVENT' and event is not None:
+            yield _parse(_eventRecord, event)
+            event = None
+        elif event is not None:
+            event[name] = value
+
+def readFacts(lines, format):
+    """ Read the facts from the lines in the given format.
+
+    The facts are read lazily as tuples of (start, end, activity, category,
+    description), None is read for items that are not valid facts. A
+    ValueError is raised for an unknown format.
+    """
+    if format == 'hamster': return readHamster(lines)
+    if format == 'csv'    : return readDelimited(lines, ',')
+    if format == 'tsv'    : return readDelimited(lines, '\t')
+    if format == 'jsonl'  : return readJsonLines(lines)
+    if format == 'ical'   : return readIcal(lines)
+    raise ValueError('Unknown import format: {0}'.format(format))
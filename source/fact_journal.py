@@ -0,0 +1,139 @@
+##########################################################################
+##
+## Copyright (c) 2017 Carel Combrink
+##
+## This file is part of the Hamster QML GUI, a QML GUI for the hamster-lib.
+##
+## The Hamster QML GUI is free software: you can redistribute it and/or
+## modify it under the terms of the GNU Lesser General Public License as
+## published by the Free Software Foundation, either version 3 of the
+## License, or (at your option) any later version.
+##
+## The Hamster QML GUI is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU Lesser General Public License for more details.
+##
+## You should have received a copy of the GNU Lesser General Public License
+## along with the Hamster QML GUI. If not, see <http://www.gnu.org/licenses/>.
+############################################################################
+import os
+import re
+import json
+import datetime
+import threading
+
+def factData(fact):
+    """ Get the journal data of a hamster-lib fact. """
+    return dict(start=fact.start.isoformat() if fact.start else None,
+                end=fact.end.isoformat() if fact.end else None,
+                activity=fact.activity.name,
+                category=fact.category.name if fact.category else '',
+                description=fact.description or '')
+
+def parseTime(value):
+    """ Get the datetime of a time in the journal data, None if there is none. """
+    return datetime.datetime.fromisoformat(value) if value else None
+
+class FactJournal():
+    """ Append-only journal of the changes made to the facts.
+
+    A change is appended to the journal before it is handed to the storage
+    and is marked as done once the storage applied it, so that a change is
+    never lost if the application stops before the storage applied it. The
+    changes that are not done are applied again when the application starts,
+    see pending(), applying a change must therefore be idempotent.
+
+    The journal is a file with a JSON object per line. Changes are synced to
+    disk when they are appended, the done markers are only flushed: losing a
+    marker only means that the change is applied again. The file is emptied
+    when all the changes are done, so that it stays small. Changes are marked
+    as done by the thread that applies them, the journal can be used from
+    several threads.
+    """
+
+    def __init__(self, path):
+        self._path    = path
+        self._file    = None
+        self._pending = {} # id -> (operation, data) of the changes that are not done
+        self._nextId  = 1
+        self._lock    = threading.Lock()
+        self._read()
+
+    def _read(self):
+        try:
+            with open(self._path, 'rb') as file:
+                content = file.read()
+        except FileNotFoundError:
+            return
+        position = 0
+        end      = 0 # The end of the last complete record
+        for line in content.splitlines(keepends=True):
+            position += len(line)
+            try:
+                record = json.loads(line) if line.endswith(b'\n') else None
+            except ValueError:
+                record = None
+            if record is None:
+                # The last line is incomplete if the application stopped
+                # while writing it, the change was not handed to the
+                # storage. Its id is not used again.
+                match = re.match(rb'\{"id": (\d+)', line)
+                if match:
+                    self._nextId = max(self._nextId, int(match.group(1)) + 1)
+                continue
+            end = position
+            if 'done' in record:
+                self._pending.pop(record['done'], None)
+                self._nextId = max(self._nextId, record['done'] + 1)
+            else:
+                self._pending[record['id']] = (record['op'], record['data'])
+                self._nextId = max(self._nextId, record['id'] + 1)
+        if end < len(content):
+            # Drop the incomplete line, so that the next change is appended
+            # on a line of its own.
+            with open(self._path, 'r+b') as file:
+                file.truncate(end)
+
+    def _open(self):
+        if self._file is None:
+            self._file = open(self._path, 'a', encoding='utf-8')
+        return self._file
+
+    def _write(self, record, sync):
+        self._open().write(json.dumps(record) + '\n')
+        self._file.flush()
+        if sync:
+            os.fsync(self._file.fileno())
+
+    def pending(self):
+        """ The changes that are not done, as (id, operation, data) in the
+        order they were appended. """
+        with self._lock:
+            return [ (id, op, data) for id, (op, data) in sorted(self._pending.items()) ]
+
+    def append(self, op, data):
+        """ Append a change, returns its id. The data must be JSON serialisable. """
+        with self._lock:
+            id = self._nextId
+            self._nextId += 1
+            self._write(dict(id=id, op=op, data=data), True)
+            self._pending[id] = (op, data)
+            return id
+
+    def done(self, id):
+        """ Mark the change as done. """
+        with self._lock:
+            if self._pending.pop(id, None) is None:
+                return
+            if self._pending:
+                self._write(dict(done=id), False)
+            else:
+                # Nothing left to apply, start a new journal.
+                self._open().truncate(0)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
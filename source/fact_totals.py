@@ -0,0 +1,155 @@
+##########################################################################
+##
+## Copyright (c) 2017 Carel Combrink
+##
+## This file is part of the Hamster QML GUI, a QML GUI for the hamster-lib.
+##
+## The Hamster QML GUI is free software: you can redistribute it and/or
+## modify it under the terms of the GNU Lesser General Public License as
+## published by the Free Software Foundation, either version 3 of the
+## License, or (at your option) any later version.
+##
+## The Hamster QML GUI is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU Lesser General Public License for more details.
+##
+## You should have received a copy of the GNU Lesser General Public License
+## along with the Hamster QML GUI. If not, see <http://www.gnu.org/licenses/>.
+############################################################################
+
+import datetime
+from PyQt5.QtCore import QObject, QDate, QVariant, pyqtProperty, pyqtSignal, pyqtSlot
+
+from hamster_pyqt import FACT_START_OFFSET
+from fact_columns import dateToDay
+
+class HqFactTotals(QObject):
+    """
+    Totals of the time spent on facts.
+
+    The totals are kept in seconds per day, per ISO week and per month, each
+    broken down by activity and by category. The totals are updated for each
+    fact that is added or removed, the facts never have to be iterated to get
+    a total. The periods are named 'day', 'week' and 'month' and are
+    identified by any date inside the period.
+
+    The totals are maintained by the FactModelPyQt for the facts it contains.
+    The model only contains the facts of the loaded days, the totals of a
+    period that starts before those days only include the facts that are
+    loaded, see complete().
+    """
+    PERIODS = ('day', 'week', 'month')
+
+    changed = pyqtSignal(name='changed')
+
+    def __init__(self, loaded = None):
+        """ The loaded function returns the first loaded day, as a QDate, and
+        whether there are facts before it. Without it all the facts are taken
+        to be loaded. """
+        super(HqFactTotals, self).__init__()
+        self._totals   = {} # (period, key) -> [total, {activity: total}, {category: total}]
+        self._revision = 0
+        self._loaded   = loaded
+
+    @staticmethod
+    def _keys(day):
+        # Get the keys of the periods that the day number belongs to.
+        date = datetime.date.fromordinal(day)
+        return (('day', day),
+                ('week', date.isocalendar()[0:2]),
+                ('month', (date.year, date.month)))
+
+    def _add(self, values, sign):
+        # The time of a fact as shown includes the start offset.
+        seconds  = sign * (values[3] + FACT_START_OFFSET)
+        activity = values[5]
+        category = values[6]
+        for key in HqFactTotals._keys(values[4]):
+            totals = self._totals.get(key)
+            if totals is None:
+                totals = [0, {}, {}]
+                self._totals[key] = totals
+            totals[0] += seconds
+            totals[1][activity] = totals[1].get(activity, 0) + seconds
+            totals[2][category] = totals[2].get(category, 0) + seconds
+            if totals[1][activity] == 0:
+                del totals[1][activity]
+            if totals[2][category] == 0:
+                del totals[2][category]
+
+    def _changed(self):
+        self._revision += 1
+        self.changed.emit()
+
+    def clear(self):
+        self._totals = {}
+        self._changed()
+
+    def add(self, facts):
+        """ Add the facts, given as FactColumns values, to the totals. """
+        for values in facts:
+            self._add(values, 1)
+        self._changed()
+
+    def remove(self, facts):
+        """ Remove the facts, given as FactColumns values, from the totals. """
+        for values in facts:
+            self._add(values, -1)
+        self._changed()
+
+    def _get(self, period, date):
+        if period not in HqFactTotals.PERIODS or not date.isValid():
+            return None
+        keys = dict(HqFactTotals._keys(dateToDay(date)))
+        return self._totals.get((period, keys[period]))
+
+    @pyqtProperty(int, notify=changed)
+    def revision(self):
+        """ Changes each time the totals change. QML bindings that use the
+        totals can depend on it to be updated when the totals change. """
+        return self._revision
+
+    @pyqtSlot(str, QDate, result=bool)
+    def complete(self, period, date):
+        """ Are all the facts of the period that contains the date loaded? If
+        not, the totals of the period only include the facts that are loaded. """
+        if period not in HqFactTotals.PERIODS or not date.isValid():
+            return False
+        if self._loaded is None:
+            return True
+        loadedFrom, hasOlder = self._loaded()
+        if period == 'week':
+            date = date.addDays(1 - date.dayOfWeek())
+        elif period == 'month':
+            date = QDate(date.year(), date.month(), 1)
+        return not hasOlder or date >= loadedFrom
+
+    @pyqtSlot(str, QDate, result=int)
+    def total(self, period, date):
+        """ Get the total seconds of the loaded facts of the period that
+        contains the date. """
+        totals = self._get(period, date)
+        return totals[0] if totals else 0
+
+    @pyqtSlot(str, QDate, result=QVariant)
+    def activities(self, period, date):
+        """ Get the total seconds per activity of the loaded facts of the
+        period that contains the date. """
+        totals = self._get(period, date)
+        return QVariant(dict(totals[1]) if totals else {})
+
+    @pyqtSlot(str, QDate, result=QVariant)
+    def categories(self, period, date):
+        """ Get the total seconds per category of the loaded facts of the
+        period that contains the date. """
+        totals = self._get(period, date)
+        return QVariant(dict(totals[2]) if totals else {})
+
+    @pyqtSlot(int, result=str)
+    def format(self, seconds):
+        """ Format seconds as hours and minutes (hh:mm). The hours are not
+        limited to a day. """
+        minutes = abs(seconds) // 60
+        return '{sign}{hours:02d}:{minutes:02d}'.format(sign='-' if seconds < 0 else '',
+                                                        hours=minutes // 60, minutes=minutes % 60)
@@ -19,16 +19,35 @@
 ############################################################################
 
 import sys
-from PyQt5.QtCore import Qt, pyqtSlot, QAbstractTableModel, QModelIndex, QByteArray, QVariant
-from PyQt5.QtCore import QTime, QDate
+from PyQt5.QtCore import Qt, pyqtProperty, pyqtSlot, QAbstractTableModel, QModelIndex, QByteArray, QVariant, QObject
+from PyQt5.QtCore import QTime, QDate, QDateTime
 
 from hamster_lib import Fact
 
 from hamster_pyqt import HamsterPyQt
 from hamster_pyqt import FactPyQt
+from hamster_pyqt import FACT_START_OFFSET, cleanStart, cleanEnd
+from fact_columns import FactColumns, dateToDay
+from fact_totals import HqFactTotals
+from instrumentation import instrumented
 
 class FactModelPyQt(QAbstractTableModel):
-    """ Fact Model """
+    """ Fact Model
+
+    The model does not load the complete history. At startup the most recent
+    page of facts is loaded, older facts are loaded a page at a time using
+    fetchMore() or for a range of days using ensureLoaded(). The facts are
+    loaded by the backend worker, they are added to the model when they
+    arrive. A model created without loading stays empty until refreshFacts()
+    is called.
+
+    The facts are stored in FactColumns, see columns(). The rows of the model
+    are always in the order of the start times of the facts: the facts are
+    sorted when loaded and facts that are added or updated are placed in
+    their row using a binary search. Views and proxy models therefore never
+    have to sort the facts themselves, see SortFilterModelPyQt.
+    """
+    FETCH_SIZE = 200 # Number of facts loaded per page
     COLUMNS = ('key'        ,
                'start'      ,
                'end'        ,
@@ -38,13 +57,24 @@ class FactModelPyQt(QAbstractTableModel):
                'duration'   ,
                'day'        )
 
-    def __init__(self, hamster):
+    def __init__(self, hamster, load = True):
         super(FactModelPyQt, self).__init__()
         self._hamster      = hamster
-        self._facts        = []
-        self._totals       = {} # Day totals maintained in the model. When the model is refreshed this
-                                # list is refreshed. When new facts are added or exising ones updated,
-                                # the totals are updated accordingly.
+        self._facts        = FactColumns()
+        self._keyStarts    = {} # Start of each fact in the model, by the key of the fact. Used
+                                # to find the row of a fact with a binary search.
+        self._loadedFrom   = QDate.currentDate() # The model only contains the facts of the days from
+                                                 # this day onwards. Views that need older facts must
+                                                 # request them using ensureLoaded().
+        self._requestedFrom = self._loadedFrom # The first day requested from the backend. The facts are
+                                               # loaded asynchronously, the loaded days follow later.
+        self._hasOlder     = False # Are there facts before the loaded days?
+        self._fetching     = False # Is a page of older facts being loaded?
+        self._overlapReported = False # Was it reported that the facts overlap?
+        self._totals       = HqFactTotals(self._loadedDays) # Totals maintained in the model. When the model
+                                                            # is refreshed the totals are refreshed. When new
+                                                            # facts are added or exising ones updated, the
+                                                            # totals are updated accordingly.
         self._roles        = QAbstractTableModel.roleNames(self)
         roleIndexes        = Qt.UserRole + 1
         self._rKey         = roleIndexes; roleIndexes += 1
@@ -66,103 +96,364 @@ class FactModelPyQt(QAbstractTableModel):
         self._roles[self._rDuration   ] = QByteArray().append(FactModelPyQt.COLUMNS[roleIndexes]); roleIndexes += 1
         self._roles[self._rDay        ] = QByteArray().append(FactModelPyQt.COLUMNS[roleIndexes]); roleIndexes += 1
 
-        self.refreshFacts()
+        if load:
+            self.refreshFacts()
         self._hamster.factUpdated.connect(self.updateFact)
         self._hamster.factAdded.connect(self.addFact)
+        self._hamster.factsImported.connect(self._factsImported)
+        self._hamster.factsChanged.connect(self._factsChanged)
+        self._hamster.setLoadedFacts(self)
+
+    def _insertFacts(self, row, facts):
+        # Insert the column values of the facts in the given row, the facts
+        # must be in order and belong in that row.
+        self.beginInsertRows(QModelIndex(), row, row + len(facts) - 1)
+        self._facts.insert(row, facts)
+        for values in facts:
+            self._keyStarts[ values[0] ] = values[1]
+        self._totals.add(facts)
+        self.endInsertRows()
+        self._checkOrder()
+
+    def _checkOrder(self):
+        # Log once that the loaded facts overlap, the facts of the days are
+        # then found by a linear scan, see FactColumns.ordered.
+        if not self._facts.ordered and not self._overlapReported:
+            self._overlapReported = True
+            print('The database contains overlapping facts, the days are searched row by row')
+
+    def _insertFact(self, values):
+        # Insert the column values of a fact in the row for its start.
+        self._insertFacts(self._facts.insertRow(values[1]), [values])
+
+    def _row(self, key):
+        # Get the row of the fact with the given key, None if it is not loaded.
+        start = self._keyStarts.get(key)
+        if start is None:
+            return None
+        return self._facts.findRow(key, start)
+
+    def _removeRow(self, row):
+        """ Remove the fact in the given row. """
+        values = self._facts.get(row)
+        self.beginRemoveRows(QModelIndex(), row, row)
+        self._totals.remove([values])
+        del self._keyStarts[ values[0] ]
+        self._facts.remove(row)
+        self.endRemoveRows()
+
+    def _daysLoaded(self, result):
+        # Insert the facts of days before the loaded days. The requests are
+        # handled in order, facts that were loaded in the mean time, by an
+        # earlier request or a refresh, are skipped.
+        first, rows, hasOlder = self._loadResult(result)
+        if first is None or QDate(first) >= self._loadedFrom:
+            return
+        self._hasOlder = hasOlder
+        loadedFrom     = dateToDay(self._loadedFrom)
+        facts          = [values for values in FactColumns.sortedValues(rows) if values[4] < loadedFrom]
+        self._loadedFrom = QDate(first)
+        # The facts end before the loaded days, unless facts overlap they start
+        # before the loaded facts as well. The facts that overlap the loaded
+        # facts are inserted in the rows for their starts.
+        starts = self._facts.starts
+        count  = len(facts)
+        while count and starts and facts[count - 1][1] > starts[0]:
+            count -= 1
+        if count:
+            self._insertFacts(0, facts[:count])
+        for values in facts[count:]:
+            self._insertFact(values)
+
+    def _loadResult(self, result):
+        # The loaded days can start before the requested days, when a page
+        # of facts is loaded.
+        first, rows, hasOlder = result
+        if first is not None and QDate(first) < self._requestedFrom:
+            self._requestedFrom = QDate(first)
+        return (first, rows, hasOlder)
 
     @pyqtSlot()
     def refreshFacts(self):
+        """ Load the facts again, at least the most recent page of facts
+        and all the days that were requested. """
+        self._hamster.loadFacts(self._requestedFrom.toPyDate(), FactModelPyQt.FETCH_SIZE, self._factsLoaded)
+
+    def _factsLoaded(self, result):
+        first, rows, hasOlder = self._loadResult(result)
+        facts = FactColumns.sortedValues(rows)
         self.beginResetModel()
-        self._facts = self._hamster.list();
-        # Clear the totals and then iterate all facts and
-        # create a map with the day and the total for that day.
-        self._totals = {}
-        for fact in self._facts:
-            day = fact.day()
-            if day not in self._totals:
-                self._totals[ day ] = QTime(0, 0, 0)
-            factDur = fact.duration()
-            self._totals[ day ] = self._totals[ day ].addMSecs( factDur.msecsSinceStartOfDay() )
+        self._loadedFrom = QDate(first)
+        self._hasOlder   = hasOlder
+        # Clear the facts and the totals and then add all facts, this
+        # creates a map with the day and the total for that day.
+        self._facts.clear()
+        self._facts.insert(0, facts)
+        self._keyStarts = { values[0]: values[1] for values in facts }
+        self._totals.clear()
+        self._totals.add(facts)
         self.endResetModel()
+        self._checkOrder()
+
+    @pyqtSlot(QDate)
+    def ensureLoaded(self, day):
+        """ Make sure that the facts from the given day onwards are in the model.
+
+        Only the days before the already requested days are fetched from the
+        backend. The facts are inserted before the facts already in the model
+        when they are loaded.
+        """
+        if not day.isValid() or day >= self._requestedFrom:
+            return
+        last = self._requestedFrom.addDays(-1)
+        self._requestedFrom = day
+        self._hamster.loadDays(day.toPyDate(), last.toPyDate(), self._daysLoaded)
+
+    def canFetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return False
+        return self._hasOlder and not self._fetching
+
+    def fetchMore(self, parent=QModelIndex()):
+        """ Load the next page of facts before the requested days. """
+        if not self.canFetchMore(parent):
+            return
+        self._fetching = True
+        self._hamster.loadPage(self._requestedFrom.toPyDate(), FactModelPyQt.FETCH_SIZE, self._pageLoaded)
+
+    def _pageLoaded(self, result):
+        self._fetching = False
+        if result[0] is None:
+            self._hasOlder = False
+            return
+        self._daysLoaded(result)
+
+    @pyqtSlot(result=QDate)
+    def loadedFrom(self):
+        """ The first day for which the facts are loaded in the model. """
+        return self._loadedFrom
 
     @pyqtSlot(FactPyQt)
+    @instrumented
     def updateFact(self, updatedFact):
-        index = len(self._facts)
-        for fact in reversed(self._facts):
-            index -= 1
-            if fact.key() == updatedFact.key():
-                # Get the duration that we know about for the fact
-                # before the fact is updated
-                factOldDur = fact.duration()
-                factOldDay = fact.day()
-                # Now replace the old fact with the new one
-                self._facts[index] = updatedFact
-                # Update the totals with the new data
-                # First remove the old duration for the old day
-                self._totals[ factOldDay ] = self._totals[ factOldDay ].addMSecs( -1 * factOldDur.msecsSinceStartOfDay() )
-                # Then add the new duration
-                factDur = updatedFact.duration();
-                factDay = updatedFact.day()
-                self._totals[ factDay ] = self._totals[ factDay ].addMSecs( factDur.msecsSinceStartOfDay() )
-                # Notify that the data changed
-                self.dataChanged.emit(self.index(index, 0), self.index(index, self.columnCount() - 1), )
-                return
+        index = self._row(updatedFact.key())
+        if index is None:
+            # The fact was not loaded, but it could have been moved into the
+            # loaded days.
+            self.addFact(updatedFact)
+            return
+        if updatedFact.day() < self._loadedFrom:
+            # The fact moved to a day that is not loaded, it no longer
+            # belongs in the model.
+            self._removeRow(index)
+            self._hasOlder = True
+            return
+        self._updateRow(index, FactColumns.factValues(updatedFact.fact()))
+
+    def _updateRow(self, index, values):
+        # Update the fact in the given row to the column values.
+        starts = self._facts.starts
+        if (index > 0 and starts[index - 1] > values[1]) or \
+           (index < len(starts) - 1 and starts[index + 1] < values[1]):
+            # The fact moved past other facts, move it to its new row.
+            self._removeRow(index)
+            self._insertFact(values)
+            return
+        # Update the totals, first remove the duration that we know about
+        # for the fact before it is updated, then add the new duration.
+        self._totals.remove([self._facts.get(index)])
+        self._facts.set(index, values)
+        self._keyStarts[ values[0] ] = values[1]
+        self._totals.add([values])
+        # Notify that the data changed
+        self.dataChanged.emit(self.index(index, 0), self.index(index, self.columnCount() - 1), )
+        self._checkOrder()
+
+    @pyqtSlot(object, object)
+    @instrumented
+    def _factsChanged(self, rows, removed):
+        """ Apply the changes that another application made to the facts, see
+        HamsterPyQt.syncChanges().
+
+        The changed facts are updated, inserted or removed by their keys, so
+        that changes that are already in the model are skipped. Without rows
+        there were too many changes and the facts are loaded again.
+        """
+        if rows is None:
+            self.refreshFacts()
+            return
+        for key in removed:
+            index = self._row(key)
+            if index is not None:
+                self._removeRow(index)
+        loadedFrom = dateToDay(self._loadedFrom)
+        for values in FactColumns.sortedValues(rows):
+            index = self._row(values[0])
+            if values[4] < loadedFrom:
+                if index is not None:
+                    self._removeRow(index)
+                self._hasOlder = True
+            elif index is None:
+                self._insertFact(values)
+            elif self._facts.get(index) != values:
+                self._updateRow(index, values)
+
+    @pyqtSlot(int, int, QDate, QDate)
+    def _factsImported(self, imported, skipped, first, last):
+        # Load the imported facts of the loaded days, facts before the loaded
+        # days are fetched when those days are requested.
+        if imported == 0:
+            return
+        if first < self._loadedFrom:
+            self._hasOlder = True
+        if last < self._loadedFrom:
+            return
+        self._hamster.factRows(max(first, self._loadedFrom).toPyDate(), last.toPyDate(), self._mergeFacts)
+
+    def _mergeFacts(self, rows):
+        """ Insert the facts of the rows that are not in the model yet.
+
+        The facts are grouped by the row they are inserted in, each group is
+        inserted as a single range of rows. Facts that are imported before or
+        after the facts in the model are inserted with a single insert.
+        """
+        loadedFrom = dateToDay(self._loadedFrom)
+        groups     = []
+        for values in FactColumns.sortedValues(rows):
+            if values[0] in self._keyStarts or values[4] < loadedFrom:
+                continue
+            row = self._facts.insertRow(values[1])
+            if groups and groups[-1][0] == row:
+                groups[-1][1].append(values)
+            else:
+                groups.append((row, [values]))
+        # The rows are found before any facts are inserted, the facts that
+        # are inserted before a group move it down.
+        inserted = 0
+        for row, facts in groups:
+            self._insertFacts(row + inserted, facts)
+            inserted += len(facts)
 
     @pyqtSlot(FactPyQt)
+    @instrumented
     def addFact(self, fact):
-        self.beginInsertRows(QModelIndex(), self.rowCount(), self.rowCount() + 1)
-        self._facts.append(fact)
-        # Add the duration to the day of the given fact
-        day = fact.day()
-        if day not in self._totals:
-            self._totals[ day ] = QTime(0, 0, 0)
-        factDur = fact.duration()
-        self._totals[ day ] = self._totals[ day ].addMSecs( factDur.msecsSinceStartOfDay()  )
-        self.endInsertRows()
+        if fact.day() < self._loadedFrom:
+            # Facts for days that are not loaded are fetched when those
+            # days are requested.
+            self._hasOlder = True
+            return
+        self._insertFact(FactColumns.factValues(fact.fact()))
 
     def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
         return len(self._facts)
 
     def columnCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
         return len(FactModelPyQt.COLUMNS)
 
+    @instrumented
     def data(self, index, role):
         if not index.isValid():
             return None
-        if   role == self._rKey         : return self._facts[index.row()].key()
-        elif role == self._rStart       : return self._facts[index.row()].start()
-        elif role == self._rEnd         : return self._facts[index.row()].end()
-        elif role == self._rActivity    : return self._facts[index.row()].activity()
-        elif role == self._rCategory    : return self._facts[index.row()].category()
-        elif role == self._rDescription : return self._facts[index.row()].description()
-        elif role == self._rDuration    : return self._facts[index.row()].duration()
-        elif role == self._rDay         : return self._facts[index.row()].day()
+        row   = index.row()
+        facts = self._facts
+        if   role == self._rKey         : return facts.keys[row]
+        elif role == self._rStart       : return facts.start(row)
+        elif role == self._rEnd         : return facts.end(row)
+        elif role == self._rActivity    : return facts.activities[row]
+        elif role == self._rCategory    : return facts.categories[row]
+        elif role == self._rDescription : return facts.descriptions[row]
+        elif role == self._rDuration    : return QTime(0, 0, FACT_START_OFFSET).addSecs(facts.durations[row])
+        elif role == self._rDay         : return facts.day(row)
         else: return None
 
     def roleNames(self):
         return self._roles
 
+    def columns(self):
+        """ The columns with the facts in the model.
+
+        Other models can use the columns to read the facts directly. The
+        columns must not be changed.
+        """
+        return self._facts
+
+    def search(self, text, start, end, callback):
+        """ Find the facts of the days from start to end that match the text,
+        see HamsterPyQt.search(). The dates are optional. """
+        self._hamster.search(text, start.toPyDate() if start.isValid() else None,
+                             end.toPyDate() if end.isValid() else None, callback)
+
+    def pageStart(self, before, callback):
+        """ Find the first day of the page of facts before the given day, see
+        HamsterPyQt.pageStart(). The callback is called with the day, which
+        is invalid if there are no facts before the day. """
+        self._hamster.pageStart(before.toPyDate(), FactModelPyQt.FETCH_SIZE,
+                                lambda day: callback(QDate(day) if day is not None else QDate()))
+
+    def overlappingFacts(self, start, end, key = None):
+        """ Get the loaded facts that a fact from start to end would overlap,
+        as FactColumns values. The times are Python datetimes as they are
+        saved, see cleanStart() and cleanEnd(). The fact with the given key is
+        left out. Facts of days that are not loaded are not checked. """
+        return [self._facts.get(row) for row in
+                self._facts.overlaps(int(start.timestamp()), int(end.timestamp()), key)]
+
+    @pyqtSlot(QDateTime, QDateTime, int, result=QVariant)
+    def conflicts(self, start, end, key):
+        """ Get the loaded facts that a fact from start to end would overlap
+        when it is saved, without the fact with the given key. """
+        facts = []
+        if start.isValid() and end.isValid():
+            for values in self.overlappingFacts(cleanStart(start.toPyDateTime()),
+                                                cleanEnd(end.toPyDateTime()), key):
+                facts.append(dict(key=values[0], start=QDateTime.fromSecsSinceEpoch(values[1]),
+                                  end=QDateTime.fromSecsSinceEpoch(values[2]), activity=values[5],
+                                  category=values[6], description=values[7]))
+        return QVariant(facts)
+
+    @pyqtSlot(QDateTime, QDateTime, int, result=bool)
+    def wouldConflict(self, start, end, key):
+        """ Would a fact from start to end overlap a loaded fact when it is
+        saved? The fact with the given key is left out. """
+        if not start.isValid() or not end.isValid():
+            return False
+        return bool(self.overlappingFacts(cleanStart(start.toPyDateTime()), cleanEnd(end.toPyDateTime()), key))
+
+    def keyRows(self, keys):
+        """ Get the rows of the facts with the given keys, in order. Facts
+        that are not loaded are left out. """
+        rows = (self._row(key) for key in keys)
+        return sorted(row for row in rows if row is not None)
+
+    def _loadedDays(self):
+        # The first loaded day and whether there are facts before it, used by
+        # the totals to tell if the facts of a period are loaded.
+        return (self._loadedFrom, self._hasOlder)
+
+    @pyqtProperty(QObject, constant=True)
+    def totals(self):
+        """ The totals of the facts in the model, see HqFactTotals. """
+        return self._totals
+
     @pyqtSlot(QDate, result='QVariant')
     def getDayTotal(self, day):
         """ Get the total time for the specified day.
 
         This function uses the day totals that are maintained inside the mode.
+        The time wraps at 24 hours, use the totals for longer times.
         """
-        duration = QTime(0, 0, 0)
-        if day in self._totals:
-          duration = self._totals[ day ]
-        return duration;
+        return QTime(0, 0, 0).addSecs(self._totals.total('day', day))
 
     @pyqtSlot(int, result='QVariant')
+    @instrumented
     def get(self, row):
         headers = {}
-        tmpFact = self._facts[row]
-        headers['key'        ] = tmpFact.key()
-        headers['start'      ] = tmpFact.start()
-        headers['end'        ] = tmpFact.end()
-        headers['activity'   ] = tmpFact.activity()
-        headers['category'   ] = tmpFact.category()
-        headers['description'] = tmpFact.description()
-        headers['duration'   ] = tmpFact.duration()
-        headers['day'        ] = tmpFact.day()
+        index = self.index(row, 0)
+        for role, name in self._roles.items():
+            if role > Qt.UserRole:
+                headers[str(name, "utf-8")] = self.data(index, role)
         return QVariant(headers)
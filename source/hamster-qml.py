@@ -18,10 +18,18 @@
 ## along with the Hamster QML GUI. If not, see <http://www.gnu.org/licenses/>.
 ############################################################################
 
+import os
 import sys
+import time
+import threading
+from collections import OrderedDict
+# The start of the application, used by the startup profile.
+cSTART_TIME = time.perf_counter()
 
 from PyQt5.QtCore    import QObject, QSettings, pyqtProperty, pyqtSignal, pyqtSlot, Qt
-from PyQt5.QtGui     import QGuiApplication, QIcon, QImage
+from PyQt5.QtCore    import QStandardPaths
+from PyQt5.QtGui     import QGuiApplication, QIcon, QImage, QPainter
+from PyQt5.QtSvg     import QSvgRenderer
 from PyQt5.QtWidgets import qApp
 from PyQt5.QtQuick   import QQuickView, QQuickImageProvider
 from PyQt5.QtQml     import qmlRegisterType, QQmlApplicationEngine
@@ -30,6 +38,8 @@ from hamster_pyqt      import HamsterPyQt, FactPyQt
 from facts_model       import FactModelPyQt
 from sort_filter_model import SortFilterModelPyQt
 from categories_model  import HqCategoriesModel
+from fact_history      import HqFactHistory
+import instrumentation
 
 cVERSION = u'0.4'
 # Set the windows ICON (need to figure out what happens on Linux)
@@ -43,23 +53,89 @@ class ImageProvider(QQuickImageProvider):
     if the style does not provide the correct image.
     The provider uses the icon naming spec from:
     https://specifications.freedesktop.org/icon-naming-spec/icon-naming-spec-latest.html
+    All the SVG and PNG images in the image folder can be used by their
+    name. As per the spec, a name that is not found falls back to the name
+    without its last '-' part, 'list-add-user' falls back to 'list-add'.
+    SVG images are rendered once per requested size, the images are kept
+    in a least recently used cache. Optionally the rendered images are
+    stored in a cache folder on disk as well.
     """
-    def __init__(self):
+    CACHE_SIZE = 128 # Number of images kept in memory
+
+    def __init__(self, imagePath = '../Resources/Images/', cachePath = None):
         super(ImageProvider, self).__init__(QQuickImageProvider.Image)
+        self._images    = {} # Path of the images by name
+        self._cache     = OrderedDict() # Images by (name, width, height), the most recent last
+        self._cachePath = cachePath
+        # Images can be requested from the threads that load images.
+        self._lock      = threading.Lock()
+        for fileName in sorted(os.listdir(imagePath)):
+          name, extension = os.path.splitext(fileName)
+          if extension.lower() == '.svg' or (extension.lower() == '.png' and name not in self._images):
+            self._images[name] = os.path.join(imagePath, fileName)
+        if cachePath is not None:
+          os.makedirs(cachePath, exist_ok=True)
+
+    def _path(self, imageId):
+        # Find the image for the name, falling back to more generic names.
+        name = imageId
+        while name:
+          if name in self._images:
+            return self._images[name]
+          name = name.rpartition('-')[0]
+        return None
+
+    def _render(self, path, size):
+        # Render the image at the requested size, keeping the aspect ratio.
+        if not path.lower().endswith('.svg'):
+          img = QImage(path)
+          if size.isValid() and not size.isEmpty():
+            img = img.scaled(size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+          return img
+        renderer = QSvgRenderer(path)
+        imgSize  = renderer.defaultSize()
+        if size.isValid() and not size.isEmpty():
+          imgSize.scale(size, Qt.KeepAspectRatio)
+        img = QImage(imgSize, QImage.Format_ARGB32_Premultiplied)
+        img.fill(Qt.transparent)
+        painter = QPainter(img)
+        renderer.render(painter)
+        painter.end()
+        return img
+
+    def _diskCachePath(self, path, size):
+        # The file name contains the modification time of the image, images
+        # that changed are rendered again.
+        return os.path.join(self._cachePath, '{0}-{1}x{2}-{3}.png'.format(
+          os.path.splitext(os.path.basename(path))[0], size.width(), size.height(),
+          os.stat(path).st_mtime_ns))
+
+    def _image(self, path, size):
+        if self._cachePath is None:
+          return self._render(path, size)
+        cached = self._diskCachePath(path, size)
+        img    = QImage(cached)
+        if img.isNull():
+          img = self._render(path, size)
+          img.save(cached)
+        return img
 
     def requestImage(self, imageId, size):
-        imagePath = '../Resources/Images/'
-        imageDict = {
-          'list-add'    : 'list-add.svg',
-          'list-remove' : 'list-remove.svg',
-          'view-refresh': 'view-refresh.svg'
-        }
-
-        imageName = imageDict.get( imageId )
-        if imageName is not None:
-          img = QImage( imagePath + imageName).scaled(size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
-        else:
+        path = self._path(imageId)
+        if path is None:
           img = QImage()
+          return img, img.size()
+        key = (path, size.width(), size.height())
+        with self._lock:
+          img = self._cache.get(key)
+          if img is not None:
+            self._cache.move_to_end(key)
+            return img, img.size()
+        img = self._image(path, size)
+        with self._lock:
+          self._cache[key] = img
+          if len(self._cache) > ImageProvider.CACHE_SIZE:
+            self._cache.popitem(last=False)
         return img, img.size()
 
 
@@ -106,20 +182,104 @@ class Settings( QObject ):
       QSettings().setValue( "DynamicActivities", value )
       self.dynamicActivitiesChanged.emit( value )
 
+class StartupProfile():
+  """
+  Timing of the startup of the application.
+  The profile is enabled with the --profile-startup argument or by setting
+  the HAMSTER_QML_PROFILE_STARTUP environment variable. The time of each
+  step is printed when the first frame was shown and all the expected
+  steps are done.
+  """
+  def __init__(self, start):
+    self._start    = start
+    self._marks    = []
+    self._expected = set()
+    self._reported = False
+    self._hamster  = None
+
+  @staticmethod
+  def enabled():
+    if '--profile-startup' in sys.argv:
+      sys.argv.remove('--profile-startup')
+      return True
+    return bool(os.environ.get('HAMSTER_QML_PROFILE_STARTUP'))
+
+  def expect(self, name):
+    """ Wait for the step with the given name before reporting. """
+    self._expected.add(name)
+
+  def mark(self, name):
+    """ Mark the end of a step. """
+    self._marks.append((name, time.perf_counter()))
+    self._expected.discard(name)
+    if not self._expected and 'First frame' in dict(self._marks):
+      self.report()
+
+  def markOnce(self, signal, name):
+    """ Mark the end of a step the first time the signal is emitted. """
+    self.expect(name)
+    def marked(*args):
+      signal.disconnect(marked)
+      self.mark(name)
+    signal.connect(marked)
+
+  def report(self, hamster = None):
+    if self._reported:
+      return
+    self._reported = True
+    print('Startup profile (ms):')
+    previous = self._start
+    for name, markTime in self._marks:
+      print('  {0:<24} {1:>8.1f} {2:>8.1f}'.format(name, (markTime - self._start) * 1000, (markTime - previous) * 1000))
+      previous = markTime
+    if self._hamster is not None:
+      for name, seconds in sorted(self._hamster.backendTimings().items()):
+        print('  {0:<24} {1:>17.1f} (worker)'.format(name, seconds * 1000))
+
 class Namespace(QObject):
     """Namespace to add clarity on the QML side, contains all Python objects
-    exposed to the QML root context as attributes."""
+    exposed to the QML root context as attributes.
+    The models are created when QML first uses them, their data is loaded
+    when loadData() is called after the first frame is shown."""
 
     hamsterLibChanged = pyqtSignal()
 
-    def __init__(self):
+    def __init__(self, profile = None):
         super(Namespace, self).__init__()
         # Initialise the value of the properties.
         self._name        = 'hamster'
+        self._profile     = profile
         self._hamster_lib = HamsterPyQt()
-        self._facts       = FactModelPyQt(self._hamster_lib);
-        self._categories  = HqCategoriesModel(self._hamster_lib)
+        self._facts       = None
+        self._categories  = None
+        self._history     = None
         self._settings    = Settings()
+        self._stats       = instrumentation.HqStats()
+        self._loaded      = False # Load the data of models when they are created?
+        if profile is not None:
+          profile._hamster = self._hamster_lib
+
+    def _loadModel(self, model, refresh, name, signal = None):
+        if self._profile is not None:
+          self._profile.markOnce(signal or model.modelReset, name)
+        refresh()
+
+    @pyqtSlot()
+    def loadData(self):
+        """ Load the data of the models that were created. Models that are
+        created after this load their data when they are created. """
+        if self._loaded:
+          return
+        self._loaded = True
+        if self._facts is not None:
+          self._loadModel(self._facts, self._facts.refreshFacts, 'Facts loaded')
+        if self._categories is not None:
+          self._loadModel(self._categories, self._categories.refreshCategories, 'Categories loaded')
+        # The history is loaded even if it is not used yet, it is needed as
+        # soon as the user starts typing.
+        if self._history is None:
+          self._history = HqFactHistory(self._hamster_lib, load=False)
+        self._loadModel(self._history, self._history.refresh, 'History loaded', self._history.changed)
 
     @pyqtProperty(str)
     def version(self):
@@ -131,18 +291,44 @@ class Namespace(QObject):
 
     @pyqtProperty(QObject, notify=hamsterLibChanged)
     def fact_model(self):
+        if self._facts is None:
+          self._facts = FactModelPyQt(self._hamster_lib, load=False)
+          if self._loaded:
+            self._loadModel(self._facts, self._facts.refreshFacts, 'Facts loaded')
         return self._facts
 
     @pyqtProperty(QObject, notify=hamsterLibChanged)
     def category_model(self):
+        if self._categories is None:
+          self._categories = HqCategoriesModel(self._hamster_lib, load=False)
+          if self._loaded:
+            self._loadModel(self._categories, self._categories.refreshCategories, 'Categories loaded')
         return self._categories
 
+    @pyqtProperty(QObject, notify=hamsterLibChanged)
+    def fact_history(self):
+        if self._history is None:
+          self._history = HqFactHistory(self._hamster_lib, load=False)
+          if self._loaded:
+            self._loadModel(self._history, self._history.refresh, 'History loaded', self._history.changed)
+        return self._history
+
     @pyqtProperty(QObject, notify=hamsterLibChanged)
     def settings(self):
       return self._settings
 
+    @pyqtProperty(QObject, constant=True)
+    def stats(self):
+      return self._stats
+
 # Main Function
 if __name__ == '__main__':
+    profile = StartupProfile(cSTART_TIME) if StartupProfile.enabled() else None
+    if profile is not None:
+      profile.mark('Imports')
+    # Instrumentation is enabled when the modules are imported, see instrumentation.
+    statsPath = instrumentation.dumpPath()
+    sys.argv = [arg for arg in sys.argv if arg != '--instrument' and not arg.startswith('--instrument=')]
     # Create main app
     sys.argv += ['--style', 'fusion']
     myApp = QGuiApplication(sys.argv)
@@ -161,13 +347,35 @@ if __name__ == '__main__':
     qmlRegisterType(SortFilterModelPyQt, 'SortFilterModelPyQt', 1, 0, 'SortFilterModelPyQt')
     # Create the QML Engine
     engine = QQmlApplicationEngine()
-    engine.addImageProvider("images", ImageProvider())
+    # The rendered icons are cached on disk if the IconDiskCache setting is set.
+    iconCache = None
+    if QSettings().value( "IconDiskCache", False, type=bool ):
+      iconCache = os.path.join( QStandardPaths.writableLocation( QStandardPaths.CacheLocation ), 'icons' )
+    engine.addImageProvider("images", ImageProvider(cachePath=iconCache))
     context = engine.rootContext()
     # Add the namespace as 'py' in the QML context. If this is done, one can
     # clearly see which objects are accessed from the python side.
-    py = Namespace()
+    py = Namespace(profile)
     context.setContextProperty('py', py)
     engine.load('qml/main.qml')
+    if not engine.rootObjects():
+      # The event loop does not run, stop the worker thread here.
+      print('Could not load qml/main.qml, see the QML errors above.', file=sys.stderr)
+      py.hamster_lib.close()
+      sys.exit(1)
+    if profile is not None:
+      profile.mark('QML load')
+    # Load the data once the first frame is shown, the window does not have
+    # to wait for the database.
+    window = engine.rootObjects()[0]
+    def firstFrame():
+      window.frameSwapped.disconnect(firstFrame)
+      py.loadData()
+      if profile is not None:
+        profile.mark('First frame')
+    window.frameSwapped.connect(firstFrame)
+    if statsPath is not None:
+      myApp.aboutToQuit.connect(lambda: instrumentation.dump(statsPath))
     sys.exit(myApp.exec_())
 
     #http://stackoverflow.com/questions/33374257/pyqt-5-5-qml-combobox
@@ -0,0 +1,828 @@
+##########################################################################
+##
+## Copyright (c) 2017 Carel Combrink
+##
+## This file is part of the Hamster QML GUI, a QML GUI for the hamster-lib.
+##
+## The Hamster QML GUI is free software: you can redistribute it and/or
+## modify it under the terms of the GNU Lesser General Public License as
+## published by the Free Software Foundation, either version 3 of the
+## License, or (at your option) any later version.
+##
+## The Hamster QML GUI is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU Lesser General Public License for more details.
+##
+## You should have received a copy of the GNU Lesser General Public License
+## along with the Hamster QML GUI. If not, see <http://www.gnu.org/licenses/>.
+############################################################################
+import os
+import re
+import time
+import queue
+import datetime
+import itertools
+from bisect import bisect_right
+from operator import itemgetter
+from datetime import timedelta
+
+from PyQt5.QtCore import QObject, QDate, pyqtSignal, pyqtSlot
+
+from hamster_lib import HamsterControl, Category, Activity, Fact
+from hamster_lib.backends.sqlalchemy.objects import AlchemyFact, AlchemyActivity, AlchemyCategory
+
+from sqlalchemy import func, create_engine, event, or_
+from sqlalchemy import text as sqlText
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import StaticPool
+from sqlalchemy.orm import joinedload, subqueryload
+
+from fact_import import readFacts
+from fact_export import writeFacts
+from fact_journal import factData, parseTime
+import instrumentation
+
+# The start time has the following offset in seconds applied when started.
+# This overcomes the issue where facts are started without specifying
+# a time that conflicts with one that was stopped by specifying a time.
+# Sometimes there were a small overlap in seconds and the backend did
+# not like this. This should ensure that this does not happen.
+FACT_START_OFFSET = 10 # seconds
+
+def cleanStart(start):
+    # Always update the start time to be on the minute with 10 seconds added.
+    # This overcomes the issue where facts are started without specifying
+    # a time that conflicts with one that was stopped by specifying a time.
+    # Sometimes there were a small overlap in seconds and the backend did
+    # not like this. This should ensure that this does not happen.
+    return start.replace(second=FACT_START_OFFSET, microsecond=0)
+
+def cleanEnd(end):
+    # Update the stop time of the fact to always be on the minute.
+    # this will overcome the issue of stopping a fact and starting
+    # one for the same minute.
+    return end.replace(second=0, microsecond=0)
+
+class HamsterBackend():
+    """ Storage calls of the Hamster QML GUI
+
+    The backend owns the HamsterControl and does all the calls to the storage.
+    It only uses and returns Python and hamster-lib objects, no Qt objects are
+    created, so that it can be used on any thread. The HamsterControl is
+    created on first use, on the thread that uses the backend, since the
+    database connection can only be used on the thread that created it.
+    """
+    IMPORT_BATCH = 1000 # Number of facts written per transaction when importing
+    EXPORT_BATCH = 1000 # Number of facts read at a time when exporting
+    # The values allowed for the sqlite options of the HamsterConfig.
+    JOURNAL_MODES = ('delete', 'truncate', 'persist', 'memory', 'wal', 'off')
+    SYNCHRONOUS   = ('off', 'normal', 'full', 'extra')
+    # Indexes used by the range queries and the overlap checks, by name.
+    INDEXES = {
+        'ix_facts_start'           : 'facts (start)',
+        'ix_facts_end'             : 'facts ("end")',
+        'ix_facts_activity_id'     : 'facts (activity_id)',
+        'ix_activities_category_id': 'activities (category_id)',
+    }
+    # The full-text index of the facts, kept up to date by triggers.
+    SEARCH_TABLE = 'CREATE VIRTUAL TABLE fact_search USING fts5(description, activity, category)'
+    SEARCH_FILL  = """INSERT INTO fact_search (rowid, description, activity, category)
+        SELECT facts.id, facts.description, activities.name, categories.name FROM facts
+        LEFT JOIN activities ON activities.id = facts.activity_id
+        LEFT JOIN categories ON categories.id = activities.category_id"""
+    SEARCH_TRIGGERS = {
+        'fact_search_insert': """AFTER INSERT ON facts BEGIN
+            INSERT INTO fact_search (rowid, description, activity, category) VALUES (new.id, new.description,
+                (SELECT name FROM activities WHERE id = new.activity_id),
+                (SELECT categories.name FROM activities JOIN categories ON categories.id = activities.category_id
+                 WHERE activities.id = new.activity_id));
+            END""",
+        'fact_search_update': """AFTER UPDATE ON facts BEGIN
+            DELETE FROM fact_search WHERE rowid = old.id;
+            INSERT INTO fact_search (rowid, description, activity, category) VALUES (new.id, new.description,
+                (SELECT name FROM activities WHERE id = new.activity_id),
+                (SELECT categories.name FROM activities JOIN categories ON categories.id = activities.category_id
+                 WHERE activities.id = new.activity_id));
+            END""",
+        'fact_search_delete': """AFTER DELETE ON facts BEGIN
+            DELETE FROM fact_search WHERE rowid = old.id;
+            END""",
+        'fact_search_activity': """AFTER UPDATE OF name, category_id ON activities BEGIN
+            DELETE FROM fact_search WHERE rowid IN (SELECT id FROM facts WHERE activity_id = new.id);
+            INSERT INTO fact_search (rowid, description, activity, category)
+                SELECT id, description, new.name, (SELECT name FROM categories WHERE id = new.category_id)
+                FROM facts WHERE activity_id = new.id;
+            END""",
+        'fact_search_category': """AFTER UPDATE OF name ON categories BEGIN
+            DELETE FROM fact_search WHERE rowid IN (SELECT facts.id FROM facts
+                JOIN activities ON activities.id = facts.activity_id WHERE activities.category_id = new.id);
+            INSERT INTO fact_search (rowid, description, activity, category)
+                SELECT facts.id, facts.description, activities.name, new.name FROM facts
+                JOIN activities ON activities.id = facts.activity_id WHERE activities.category_id = new.id;
+            END""",
+    }
+    # The log of the changes to the facts, activities and categories, kept by
+    # triggers so that the changes of other applications are logged as well.
+    CHANGES_TABLE = """CREATE TABLE IF NOT EXISTS hq_changes (
+        seq  INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        key  INTEGER NOT NULL,
+        time REAL NOT NULL DEFAULT (julianday('now')))"""
+    CHANGES_TRIGGERS = {
+        'hq_changes_{0}_{1}'.format(kind, op): "AFTER {0} ON {1} BEGIN INSERT INTO hq_changes (kind, key) VALUES ('{2}', {3}.id); END".format(
+            op.upper(), table, kind, 'old' if op == 'delete' else 'new')
+        for kind, table in (('fact', 'facts'), ('activity', 'activities'), ('category', 'categories'))
+        for op in ('insert', 'update', 'delete')
+    }
+    CHANGES_DAYS  = 7    # Days that the changes are kept in the log
+    CHANGES_LIMIT = 1000 # Changes after which the facts are loaded again instead
+    CHANGES_PRUNE = 3600 # Seconds between the removals of the old changes
+    def __init__(self, config):
+        self._config  = config
+        self._control = None
+        self._timings = {} # Seconds taken by the initialisation steps
+        self._search  = False # Is the full-text index used?
+        self._changes     = False # Is the change log used?
+        self._changeSeq   = 0     # The last change in the log that was seen
+        self._dataVersion = None  # The sqlite data_version when the log was last read
+        self._changesPruned = 0.0 # The time.monotonic() when the old changes were last removed
+
+    @property
+    def control(self):
+        if self._control is None:
+            start   = time.perf_counter()
+            control = HamsterControl(self._config)
+            self._timings['HamsterControl init'] = time.perf_counter() - start
+            if self._config.get('db_engine') == 'sqlite':
+                # The control is only kept once it is set up, so that a failed
+                # setup is reported again instead of using the database
+                # without its options.
+                start = time.perf_counter()
+                try:
+                    self._setupSqlite(control)
+                except Exception:
+                    control.store.session.close()
+                    control.store.session.get_bind().dispose()
+                    raise
+                self._timings['Database setup'] = time.perf_counter() - start
+            self._control = control
+        return self._control
+
+    def _pragmas(self):
+        """ The pragmas of the sqlite options of the configuration. """
+        pragmas = []
+        mode = self._config.get('sqlite_journal_mode').strip().lower()
+        if mode:
+            if mode not in self.JOURNAL_MODES:
+                raise ValueError('Invalid sqlite_journal_mode: {0}'.format(mode))
+            pragmas.append('PRAGMA journal_mode = {0}'.format(mode))
+        synchronous = self._config.get('sqlite_synchronous').strip().lower()
+        if synchronous:
+            if synchronous not in self.SYNCHRONOUS:
+                raise ValueError('Invalid sqlite_synchronous: {0}'.format(synchronous))
+            pragmas.append('PRAGMA synchronous = {0}'.format(synchronous))
+        for key, pragma in (('sqlite_cache_size', 'cache_size'), ('sqlite_mmap_size', 'mmap_size')):
+            value = self._config.get(key).strip()
+            if value:
+                try:
+                    pragmas.append('PRAGMA {0} = {1}'.format(pragma, int(value)))
+                except ValueError:
+                    raise ValueError('Invalid {0}: {1}'.format(key, value))
+        return pragmas
+
+    def _setupSqlite(self, control):
+        """ Set up the sqlite database of the HamsterControl.
+
+        The hamster-lib opens a new connection for every transaction, which
+        drops the connection cache each time. If db_keep_connection is set
+        the session is bound to an engine that keeps a single connection
+        open. The backend is only used on one thread, a connection per
+        thread is not kept since the thread-local state of the worker thread
+        does not survive between requests. The pragmas are applied to every
+        new connection and the indexes are created if they do not exist yet,
+        see _setupSearch() for the full-text index.
+        """
+        store   = control.store
+        engine  = store.session.get_bind()
+        pragmas = self._pragmas()
+        if self._config.getBool('db_keep_connection'):
+            engine = create_engine(engine.url, poolclass=StaticPool)
+            store.session.bind = engine
+        @event.listens_for(engine, 'connect')
+        def connect(connection, record):
+            cursor = connection.cursor()
+            for pragma in pragmas:
+                cursor.execute(pragma)
+            cursor.close()
+        if self._config.getBool('db_indexes'):
+            with engine.begin() as connection:
+                for name, columns in self.INDEXES.items():
+                    connection.execute('CREATE INDEX IF NOT EXISTS {0} ON {1}'.format(name, columns))
+        with engine.begin() as connection:
+            self._setupSearch(connection)
+            self._setupChanges(connection)
+
+    def _setupSearch(self, connection):
+        """ Set up the full-text index of the facts if db_search is set.
+
+        The index is an sqlite FTS5 table of the descriptions and the names of
+        the activities and categories of the facts. It is filled when it is
+        created and kept up to date by triggers, also for changes made by
+        other applications. Since the triggers need FTS5, the index is removed
+        if db_search is not set, so that applications using an sqlite without
+        FTS5 can still change the facts. Without the index search() falls back
+        to matching the names with LIKE.
+        """
+        exists = connection.execute("SELECT 1 FROM sqlite_master WHERE name = 'fact_search'").scalar()
+        if not self._config.getBool('db_search'):
+            for name in self.SEARCH_TRIGGERS:
+                connection.execute('DROP TRIGGER IF EXISTS {0}'.format(name))
+            connection.execute('DROP TABLE IF EXISTS fact_search')
+            return
+        try:
+            if not exists:
+                connection.execute(self.SEARCH_TABLE)
+                connection.execute(self.SEARCH_FILL)
+            for name, trigger in self.SEARCH_TRIGGERS.items():
+                connection.execute('CREATE TRIGGER IF NOT EXISTS {0} {1}'.format(name, trigger))
+        except OperationalError:
+            # The sqlite library does not have FTS5.
+            return
+        self._search = True
+
+    def _setupChanges(self, connection):
+        """ Set up the change log of the database if db_changes is set.
+
+        The triggers log the key of every fact, activity and category that is
+        inserted, updated or deleted, by any application, see changes(). The
+        changes older than CHANGES_DAYS are removed, here and every
+        CHANGES_PRUNE while the changes are read. The log and its triggers are
+        removed if db_changes is not set.
+        """
+        if not self._config.getBool('db_changes'):
+            for name in self.CHANGES_TRIGGERS:
+                connection.execute('DROP TRIGGER IF EXISTS {0}'.format(name))
+            connection.execute('DROP TABLE IF EXISTS hq_changes')
+            return
+        connection.execute(self.CHANGES_TABLE)
+        for name, trigger in self.CHANGES_TRIGGERS.items():
+            connection.execute('CREATE TRIGGER IF NOT EXISTS {0} {1}'.format(name, trigger))
+        self._pruneChanges(connection)
+        self._changeSeq = connection.execute('SELECT coalesce(max(seq), 0) FROM hq_changes').scalar()
+        self._changes   = True
+
+    def _pruneChanges(self, connection):
+        # Remove the changes older than CHANGES_DAYS from the log.
+        connection.execute(sqlText("DELETE FROM hq_changes WHERE time < julianday('now') - :days"),
+                           {'days': self.CHANGES_DAYS})
+        self._changesPruned = time.monotonic()
+
+    def changes(self, first = None):
+        """ Get the changes to the facts, activities and categories since the
+        last call, for example the changes of another application.
+
+        Returns None if nothing changed, otherwise a tuple of the rows of the
+        facts that were added or updated, as (key, start, end, activity,
+        category, description), the keys of the facts that were removed and
+        if the activities or categories changed. Only the facts of the days
+        from the given day onwards are returned, facts that moved to an
+        earlier day are returned as removed. The rows are None if there are
+        more than CHANGES_LIMIT changes, or if changes were removed from the
+        log before they were seen, then all the facts must be loaded again.
+
+        The changes of this backend are returned as well, unless sqlite
+        reports that no other connection changed the database since the last
+        call. That check only works if the connection is kept open.
+        """
+        if not self._changes:
+            return None
+        session = self.control.store.session
+        if time.monotonic() - self._changesPruned > self.CHANGES_PRUNE:
+            self._pruneChanges(session)
+            session.commit()
+        # The data_version and the changes are read by a single statement, so
+        # that they are read from the same snapshot of the database.
+        version, oldest, last = session.execute(
+            'SELECT (SELECT data_version FROM pragma_data_version()), min(seq), max(seq) FROM hq_changes').first()
+        previous = self._dataVersion
+        if self._config.getBool('db_keep_connection'):
+            self._dataVersion = version
+        if last is None or last <= self._changeSeq:
+            return None
+        if previous is not None and version == previous:
+            # Only this connection changed the database since the last
+            # call, the changes are known already.
+            self._changeSeq = last
+            return None
+        if oldest > self._changeSeq + 1:
+            self._changeSeq = last
+            return (None, [], True)
+        logged = session.execute(sqlText('SELECT kind, key FROM hq_changes WHERE seq > :first AND seq <= :last'),
+                                 {'first': self._changeSeq, 'last': last}).fetchall()
+        self._changeSeq = last
+        if len(logged) > self.CHANGES_LIMIT:
+            return (None, [], True)
+        keys = { 'fact': set(), 'activity': set(), 'category': set() }
+        for kind, key in logged:
+            keys[kind].add(key)
+        # Renamed activities and categories change the rows of their facts.
+        conditions = []
+        if keys['fact']:
+            conditions.append(AlchemyFact.pk.in_(keys['fact']))
+        if keys['activity']:
+            conditions.append(AlchemyActivity.pk.in_(keys['activity']))
+        if keys['category']:
+            conditions.append(AlchemyCategory.pk.in_(keys['category']))
+        rows = []
+        if conditions:
+            rows = self._factRowsQuery(first, None).filter(or_(*conditions)).all()
+        removed = list(keys['fact'].difference(row[0] for row in rows))
+        return (rows, removed, bool(keys['activity'] or keys['category']))
+
+    def timings(self):
+        """ The seconds taken by the initialisation steps of the backend, by name. """
+        return dict(self._timings)
+
+    def close(self):
+        """ Close the database session, on the thread that used it. """
+        if self._control is not None:
+            self._control.store.session.close()
+            self._control.store.cleanup()
+            self._control.store.session.get_bind().dispose()
+
+    def _dayStart(self, day):
+        """ Get the datetime at which the given day starts.
+
+        The day can be a QDate, a datetime.date or a datetime.datetime. None
+        or an invalid QDate results in None.
+        """
+        if isinstance(day, QDate):
+            if not day.isValid():
+                return None
+            day = day.toPyDate()
+        if isinstance(day, datetime.datetime):
+            day = day.date()
+        if day is None:
+            return None
+        return datetime.datetime.combine(day, datetime.time())
+
+    def _filterDays(self, query, start_time, end_time):
+        """ Filter the query for the facts that belongs to the days from start_time
+        up to and including end_time, ordered by the start of the facts.
+
+        A fact belongs to the day on which it ended, the same as FactPyQt.day().
+        """
+        start = self._dayStart(start_time)
+        end   = self._dayStart(end_time)
+        if start:
+            query = query.filter(AlchemyFact.end >= start)
+        if end:
+            query = query.filter(AlchemyFact.end < end + timedelta(days=1))
+        return query.order_by(AlchemyFact.start)
+
+    def facts(self, start_time = None, end_time = None):
+        """ Get the hamster-lib facts of the days from start_time up to end_time.
+
+        The activity and category of the facts are loaded with the facts to
+        prevent a query per fact when converting to hamster-lib facts.
+        """
+        query = self.control.store.session.query(AlchemyFact).options(
+            joinedload(AlchemyFact.activity).joinedload(AlchemyActivity.category),
+            subqueryload(AlchemyFact.tags))
+        return [fact.as_hamster() for fact in self._filterDays(query, start_time, end_time)]
+
+    def factRows(self, start_time = None, end_time = None):
+        """ List the facts for the days between the supplied start and end times
+        as tuples of (key, start, end, activity, category, description).
+
+        This is the same as facts() but without creating objects for the facts,
+        it is meant for loading many facts into a model.
+        """
+        return self._factRowsQuery(start_time, end_time).all()
+
+    def _factRowsQuery(self, start_time, end_time):
+        query = self.control.store.session.query(
+            AlchemyFact.pk, AlchemyFact.start, AlchemyFact.end,
+            AlchemyActivity.name, AlchemyCategory.name, AlchemyFact.description)
+        query = query.join(AlchemyFact.activity).outerjoin(AlchemyActivity.category)
+        return self._filterDays(query, start_time, end_time)
+
+    def pageStart(self, before = None, count = 1):
+        """ Get the first day of the page of facts that ends before the given day.
+
+        The page contains the given number of the most recent facts before the day,
+        or all of them if there are less. The page is extended to contain all the
+        facts of the day it starts on. None is returned when there are no facts
+        before the day.
+        """
+        query = self.control.store.session.query(AlchemyFact.end)
+        if before:
+            query = query.filter(AlchemyFact.end < self._dayStart(before))
+        end = query.order_by(AlchemyFact.end.desc()).offset(count - 1).limit(1).scalar()
+        if end is None:
+            # Less facts than the page size, the page starts at the oldest fact.
+            end = query.order_by(AlchemyFact.end).limit(1).scalar()
+        if end is None:
+            return None
+        return end.date()
+
+    def loadFacts(self, loadedFrom, count):
+        """ Get the rows of the facts from the given day, extended to contain at
+        least the most recent page of facts.
+
+        Returns the first day of the rows, the rows and if there are older facts.
+        """
+        first = self.pageStart(None, count)
+        if first is None or first > loadedFrom:
+            first = loadedFrom
+        return (first, self.factRows(first), self.pageStart(first) is not None)
+
+    def loadDays(self, first, last):
+        """ Get the rows of the facts of the days from first up to and including last.
+
+        Returns the first day, the rows and if there are facts before the first day.
+        """
+        return (first, self.factRows(first, last), self.pageStart(first) is not None)
+
+    def loadPage(self, before, count):
+        """ Get the rows of the page of facts before the given day, see pageStart().
+
+        Returns the first day of the page, the rows and if there are facts before
+        the page. The first day is None if there are no facts before the day.
+        """
+        first = self.pageStart(before, count)
+        if first is None:
+            return (None, [], False)
+        return self.loadDays(first, before - timedelta(days=1))
+
+    def tmpFact(self):
+        """ The ongoing fact, None if there is none. """
+        try:
+            return self.control.facts.get_tmp_fact()
+        except KeyError:
+            return None
+
+    def _detached(self, item):
+        """ Get the hamster-lib object for an object of the storage.
+
+        Some managers return the objects of the storage, their attributes are
+        loaded from the database when they are expired. The objects that are
+        returned by the backend must not use the database, since they are used
+        on other threads.
+        """
+        if isinstance(item, (AlchemyFact, AlchemyActivity, AlchemyCategory)):
+            return item.as_hamster()
+        return item
+
+    def save(self, fact):
+        return self._detached(self.control.facts.save(fact))
+
+    def stop(self, end):
+        """ Stop the ongoing fact at the given end time. """
+        fact = self._detached(self.control.facts.stop_tmp_fact())
+        fact.end = end
+        return self._detached(self.control.facts.save(fact))
+
+    def cancel(self):
+        try:
+            self.control.facts.cancel_tmp_fact()
+        except KeyError:
+            print('No fact to cancel')
+
+    def applyJournal(self, op, data, done = None):
+        """ Apply a change of the FactJournal.
+
+        A change can be applied again after it was applied, when the
+        application stopped before the change was marked as done. Changes
+        that were applied already are not applied again:
+         - 'start' stops the ongoing fact at the start of the fact and saves
+           the fact, unless the fact is already the ongoing fact or a fact
+           with the same start is saved, ongoing facts are saved when they
+           are stopped. Returns the fact that was stopped, or None, and the
+           fact.
+         - 'stop' stops the ongoing fact at the end, if there is one. Returns
+           the fact that was stopped, or None.
+         - 'cancel' cancels the ongoing fact, if there is one.
+
+        The done callback is called once the change was handled, also if it
+        failed, so that the change is marked as done by the worker and not
+        only when the result reaches the GUI thread.
+        """
+        try:
+            if op == 'start':
+                return self._journalStart(data)
+            if op == 'stop':
+                if self.tmpFact() is None:
+                    return None
+                return self.stop(parseTime(data['end']))
+            if op == 'cancel':
+                if self.tmpFact() is not None:
+                    self.cancel()
+                return None
+            raise ValueError('Unknown journal operation: {0}'.format(op))
+        finally:
+            if done is not None:
+                done()
+
+    def _journalStart(self, data):
+        start   = parseTime(data['start'])
+        end     = parseTime(data['end'])
+        current = self.tmpFact()
+        if end is None and current is not None and factData(current) == data:
+            return (None, current)
+        saved = self.control.store.session.query(AlchemyFact).filter(AlchemyFact.start == start).first()
+        if saved is not None:
+            return (None, self._detached(saved))
+        stopped = None
+        if current is not None:
+            # Stop the ongoing fact before the fact starts. If that fails the
+            # storage reports the ongoing fact when the fact is saved.
+            try:
+                stopped = self.stop(cleanEnd(start))
+            except ValueError:
+                pass
+        category = Category(data['category']) if data['category'] else None
+        fact     = Fact(Activity(data['activity'], category=category), start, end,
+                        description=data['description'] or None)
+        return (stopped, self.save(fact))
+
+    def updateFact(self, key, start, end, activity, category, description):
+        """ Update the fact with the given key, raises a KeyError if there is no
+        such fact. The updated fact is read again, the fact that the storage
+        returns does not have the keys of an activity and category that the
+        update created. """
+        fact = self.control.facts.get(key)
+        # Check the category. An empty category is accepted by the backend
+        # but it can not have an empty name, it must be 'None' instead.
+        cat = None
+        if category:
+            cat = Category(category)
+        fact.start       = start
+        fact.end         = end
+        fact.activity    = Activity(activity, category=cat)
+        fact.description = description
+        saved = self.control.facts.save(fact)
+        return self._detached(self.control.facts.get(saved.pk))
+
+    def categories(self):
+        """ All the categories and all the activities, with their dependency
+        counts, see dependencyCounts(). """
+        categories = [ self._detached(category) for category in self.control.categories.get_all() ]
+        activities = [ self._detached(activity) for activity in self.control.activities.get_all() ]
+        return (categories, activities) + self.dependencyCounts()
+
+    def dependencyCounts(self):
+        """ Count the facts of each activity and the activities of each category.
+
+        Returns dictionaries with the counts by the keys of the activities and
+        the categories, uncategorised activities are counted for key -1. The
+        counts are done with a single query.
+        """
+        query = self.control.store.session.query(
+            AlchemyActivity.pk, AlchemyActivity.category_id, func.count(AlchemyFact.pk))
+        query = query.outerjoin(AlchemyActivity.facts).group_by(AlchemyActivity.pk)
+        facts      = {}
+        activities = {}
+        for activity, category, count in query:
+            if category is None:
+                category = -1
+            facts[ activity ]      = count
+            activities[ category ] = activities.get( category, 0 ) + 1
+        return (facts, activities)
+
+    def search(self, text, start_time = None, end_time = None):
+        """ Find the facts that match the text, of the days from start_time up
+        to and including end_time.
+
+        Every word of the text must be the start of a word in the description,
+        activity or category of a fact, ignoring the case. Returns the keys of
+        the facts that match and the first day of the facts, None if no fact
+        matches.
+        """
+        words = re.findall(r'\w+', text)
+        if not words:
+            return ([], None)
+        session = self.control.store.session
+        query   = session.query(AlchemyFact.pk, AlchemyFact.end)
+        if self._search:
+            match = ' '.join('"{0}"*'.format(word) for word in words)
+            query = query.filter(AlchemyFact.pk.in_(
+                sqlText('SELECT rowid FROM fact_search WHERE fact_search MATCH :match').bindparams(match=match)))
+        else:
+            query = query.join(AlchemyFact.activity).outerjoin(AlchemyActivity.category)
+            for word in words:
+                pattern = '%{0}%'.format(word.replace('_', '\\_'))
+                query   = query.filter(or_(AlchemyFact.description.ilike(pattern, escape='\\'),
+                                           AlchemyActivity.name.ilike(pattern, escape='\\'),
+                                           AlchemyCategory.name.ilike(pattern, escape='\\')))
+        rows = self._filterDays(query, start_time, end_time).all()
+        if not rows:
+            return ([], None)
+        return ([key for key, end in rows], min(end for key, end in rows).date())
+
+    def history(self):
+        """ Count the facts of each activity with each description.
+
+        Returns a list of (activity, category, description, count, last) with
+        the names, the number of facts and the start of the most recent fact.
+        The counts are done with a single query.
+        """
+        query = self.control.store.session.query(
+            AlchemyActivity.name, AlchemyCategory.name, AlchemyFact.description,
+            func.count(AlchemyFact.pk), func.max(AlchemyFact.start))
+        query = query.select_from(AlchemyFact).join(AlchemyFact.activity).outerjoin(AlchemyActivity.category)
+        return query.group_by(AlchemyFact.activity_id, AlchemyFact.description).all()
+
+    def removeCategory(self, pk):
+        category = self.control.categories.get( pk )
+        if category is None:
+            return False
+        self.control.categories.remove( category )
+        return True
+
+    def removeActivity(self, pk):
+        activity = self.control.activities.get( pk )
+        if activity is None:
+            return False
+        self.control.activities.remove( activity )
+        return True
+
+    def addActivity(self, activityName, categoryName):
+        """ Add the activity and category if they do not exist yet. Returns the
+        category and the activity, None for the ones that were not given. """
+        category = None
+        activity = None
+        if categoryName != "" and categoryName != "(uncategorised)":
+            category = self.control.categories.get_or_create(Category(categoryName))
+
+        if activityName != "":
+            activity = self.control.activities.get_or_create(Activity(activityName, category=category))
+
+        return (self._detached(category), self._detached(activity))
+
+
+    def _activityKey(self, activities, name, categoryName):
+        # Get the key of the activity, the activity and its category are
+        # created if needed. The keys are cached in the activities dictionary.
+        key = activities.get((name, categoryName))
+        if key is None:
+            category = None
+            if categoryName:
+                category = self.control.categories.get_or_create(Category(categoryName))
+            key = self.control.activities.get_or_create(Activity(name, category=category)).pk
+            activities[(name, categoryName)] = key
+        return key
+
+    def _importBatch(self, records, activities):
+        """ Write the valid facts of a batch in a single transaction.
+
+        The facts are checked against each other and against the facts in the
+        storage, facts that overlap are skipped. Returns the written facts.
+        """
+        minDelta = timedelta(seconds=int(self._config.get('fact_min_delta', '0') or 0))
+        facts    = []
+        for record in records:
+            if record is None or record[0] is None or record[1] is None or not record[2]:
+                continue
+            start = cleanStart(record[0])
+            end   = cleanEnd(record[1])
+            if end - start < max(minDelta, timedelta(seconds=1)):
+                continue
+            facts.append((start, end) + record[2:])
+        if not facts:
+            return []
+        facts.sort(key=itemgetter(0))
+        # The stored facts do not overlap, sorted by start they are sorted by end
+        # as well. The overlaps are found with a binary search.
+        session = self.control.store.session
+        stored  = session.query(AlchemyFact.start, AlchemyFact.end).filter(
+            AlchemyFact.end > facts[0][0], AlchemyFact.start < max(fact[1] for fact in facts)
+            ).order_by(AlchemyFact.start).all()
+        starts  = [fact[0] for fact in stored]
+        ends    = [fact[1] for fact in stored]
+        written = []
+        lastEnd = None
+        for fact in facts:
+            start, end = fact[0], fact[1]
+            index = bisect_right(starts, start)
+            if (lastEnd is not None and start < lastEnd) or \
+               (index > 0 and ends[index - 1] > start) or \
+               (index < len(starts) and starts[index] < end):
+                continue
+            written.append(fact)
+            lastEnd = end
+        session.bulk_insert_mappings(AlchemyFact, [
+            dict(start=fact[0], end=fact[1], description=fact[4],
+                 activity_id=self._activityKey(activities, fact[2], fact[3])) for fact in written ])
+        session.commit()
+        return written
+
+    def importFacts(self, path, format, progress = None):
+        """ Import the facts from the file in the given format, see fact_import.
+
+        The file is read lazily and the facts are written in batches of
+        IMPORT_BATCH facts, each in a single transaction. Facts that are not
+        valid or overlap other facts are skipped. After each batch progress is
+        called with the number of imported and skipped facts and the percentage
+        of the file that was read.
+
+        Returns the number of imported and skipped facts and the first and last
+        days of the imported facts.
+        """
+        size       = max(os.path.getsize(path), 1)
+        read       = [0]
+        activities = {}
+        imported   = 0
+        skipped    = 0
+        first      = None
+        last       = None
+        def lines(file):
+            for line in file:
+                read[0] += len(line)
+                yield line
+        with open(path, newline='', encoding='utf-8') as file:
+            records = readFacts(lines(file), format)
+            while True:
+                batch = list(itertools.islice(records, HamsterBackend.IMPORT_BATCH))
+                if not batch:
+                    break
+                written   = self._importBatch(batch, activities)
+                imported += len(written)
+                skipped  += len(batch) - len(written)
+                if written:
+                    # A fact belongs to the day on which it ended, the written
+                    # facts do not overlap so the first ends first.
+                    firstDay = written[0][1].date()
+                    lastDay  = written[-1][1].date()
+                    first    = firstDay if first is None else min(first, firstDay)
+                    last     = lastDay if last is None else max(last, lastDay)
+                if progress is not None:
+                    progress((imported, skipped, min(100, read[0] * 100 // size)))
+        return (imported, skipped, first, last)
+
+
+    def exportFacts(self, path, format, start_time = None, end_time = None, progress = None):
+        """ Export the facts of the days from start_time up to end_time to the file
+        in the given format, see fact_export.
+
+        The facts are read from the storage EXPORT_BATCH facts at a time and
+        written as they are read, the memory used does not depend on the number
+        of facts. After each batch progress is called with the number of
+        exported facts and the percentage done. Returns the number of facts.
+        """
+        total    = max(self._factRowsQuery(start_time, end_time).count(), 1)
+        exported = [0]
+        def rows():
+            for row in self._factRowsQuery(start_time, end_time).yield_per(HamsterBackend.EXPORT_BATCH):
+                yield row
+                exported[0] += 1
+                if progress is not None and exported[0] % HamsterBackend.EXPORT_BATCH == 0:
+                    progress((exported[0], exported[0] * 100 // total))
+        with open(path, 'w', newline='', encoding='utf-8') as file:
+            for text in writeFacts(rows(), format):
+                file.write(text)
+        if progress is not None:
+            progress((exported[0], 100))
+        return exported[0]
+
+
+class HamsterWorker(QObject):
+    """ Runs the calls of a HamsterBackend on the thread of the worker.
+
+    Each request is identified by a number. The result of the call, or the
+    exception it raised, is reported with finished(). Requests with a negative
+    number are waited for, their results are put in the replies queue instead.
+    Long calls can report their progress with progress().
+    """
+    finished = pyqtSignal(int, object, object, name='finished')
+    progress = pyqtSignal(int, object, name='progress')
+
+    def __init__(self, backend):
+        super(HamsterWorker, self).__init__()
+        self._backend = backend
+        self.replies  = queue.Queue()
+
+    def call(self, name, args):
+        """ Call the backend, returns the result and the exception raised. """
+        if instrumentation.ENABLED:
+            start = time.perf_counter_ns()
+            try:
+                return self._call(name, args)
+            finally:
+                instrumentation.record('HamsterBackend.' + name, time.perf_counter_ns() - start)
+        return self._call(name, args)
+
+    def _call(self, name, args):
+        try:
+            return (getattr(self._backend, name)(*args), None)
+        except Exception as err:
+            return (None, err)
+
+    @pyqtSlot(int, str, object)
+    def run(self, request, name, args):
+        result, error = self.call(name, args)
+        if request < 0:
+            self.replies.put((result, error))
+        else:
+            self.finished.emit(request, result, error)
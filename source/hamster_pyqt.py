@@ -17,63 +17,103 @@
 ## You should have received a copy of the GNU Lesser General Public License
 ## along with the Hamster QML GUI. If not, see <http://www.gnu.org/licenses/>.
 ############################################################################
+import os
 import sys
 import datetime
-from datetime import timedelta
+import configparser
 
-from PyQt5.QtCore import QObject, pyqtSignal, pyqtSlot, QDateTime, QDate, QTime
+from PyQt5.QtCore import QObject, QFileSystemWatcher, QThread, QTimer, QCoreApplication, pyqtSignal, pyqtSlot, QDateTime, QDate, QTime, QUrl
 
 import hamster_lib
-from hamster_lib import Fact, HamsterControl, reports, Category, Activity
+from hamster_lib import Fact
 from hamster_lib.helpers import time as time_helpers
 
-# The start time has the following offset in seconds applied when started.
-# This overcomes the issue where facts are started without specifying
-# a time that conflicts with one that was stopped by specifying a time.
-# Sometimes there were a small overlap in seconds and the backend did
-# not like this. This should ensure that this does not happen.
-FACT_START_OFFSET = 10 # seconds
+from hamster_backend import HamsterBackend, HamsterWorker, FACT_START_OFFSET, cleanStart, cleanEnd
+import fact_import
+import fact_export
+from fact_journal import FactJournal, factData
+from instrumentation import instrumented
 
 class FactPyQt(QObject):
-    """ QObject wrapper for a fact """
+    """ QObject wrapper for a fact
+
+    The wrapper is a value object, the fact must not be changed after it is
+    wrapped. The values are converted to their Qt types the first time they
+    are requested and cached after that, since the models and QML ask for the
+    same values many times when sorting, filtering and painting.
+    """
+
     def __init__(self, fact):
         super(FactPyQt, self).__init__()
-        self._fact = fact
+        self._fact        = fact
+        self._key         = fact.pk
+        self._activity    = fact.activity.name
+        self._category    = fact.category.name if fact.category else ""
+        self._description = fact.description or ""
+        self._start       = None
+        self._end         = None
+        self._duration    = None
+        self._day         = None
+
+    def fact(self):
+        """ The wrapped hamster-lib fact. """
+        return self._fact
 
     @pyqtSlot(result='QDateTime')
     def start(self):
-        return QDateTime(self._fact.start)
+        if self._start is None:
+            self._start = QDateTime(self._fact.start)
+        return self._start
 
     @pyqtSlot(result='QDateTime')
     def end(self):
-        return QDateTime(self._fact.end)
+        if self._end is None:
+            if self._fact.end is None:
+                # Ongoing facts do not have an end (yet)
+                self._end = QDateTime()
+            else:
+                self._end = QDateTime(self._fact.end)
+        return self._end
 
     @pyqtSlot(result='QString')
     def description(self):
-        return self._fact.description
+        return self._description
 
     @pyqtSlot(result='QString')
     def category(self):
-        if not self._fact.category:
-            return ""
-        else:
-            return self._fact.category.name
+        return self._category
 
     @pyqtSlot(result='QString')
     def activity(self):
-        return self._fact.activity.name
+        return self._activity
 
     @pyqtSlot(result='int')
     def key(self):
-        return self._fact.pk
+        return self._key
+
+    @pyqtSlot(result=int)
+    def elapsed(self):
+        """ Seconds from the start to the end of the fact. For an ongoing
+        fact the seconds up to now are returned. """
+        end = self._fact.end
+        if end is None:
+            end = datetime.datetime.now()
+        return int((end - self._fact.start).total_seconds())
 
     @pyqtSlot(result='QTime')
     def duration(self):
-        return QTime(0, 0, FACT_START_OFFSET).addSecs(self.start().secsTo(self.end()))
+        if self._fact.end is None:
+            # The duration of an ongoing fact changes, it can not be cached.
+            return QTime(0, 0, FACT_START_OFFSET).addSecs(self.elapsed())
+        if self._duration is None:
+            self._duration = QTime(0, 0, FACT_START_OFFSET).addSecs(self.elapsed())
+        return self._duration
 
     @pyqtSlot(result='QDate')
     def day(self):
-        return self.end().date()
+        if self._day is None:
+            self._day = self.end().date()
+        return self._day
 
 class HqActivity(QObject):
     """ HamsterQML QObject wrapper for a Activity
@@ -81,9 +121,10 @@ class HqActivity(QObject):
     The hamster object must be wrapped by a QObject to be
     able to access the slot members from QML
     """
-    def __init__(self, activity):
+    def __init__(self, activity, dependents = 0):
         super(HqActivity, self).__init__()
-        self._activity = activity
+        self._activity   = activity
+        self._dependents = dependents
 
     @pyqtSlot(result=str)
     def name(self):
@@ -93,6 +134,21 @@ class HqActivity(QObject):
     def categoryName(self):
       return self._activity.category.name
 
+    @pyqtSlot(result=int)
+    def categoryKey(self):
+      if self._activity.category is None:
+        return -1
+      return self._activity.category.pk
+
+    def category(self):
+      """ The HqCategory of the activity. """
+      return HqCategory(self._activity.category)
+
+    @pyqtSlot(result=int)
+    def dependents(self):
+      """ The number of facts of the activity. """
+      return self._dependents
+
     @pyqtSlot(result=int)
     def key(self):
       return self._activity.pk
@@ -103,10 +159,11 @@ class HqCategory(QObject):
     The hamster object must be wrapped by a QObject to be
     able to access the slot members from QML
     """
-    def __init__(self, category = None):
+    def __init__(self, category = None, dependents = 0):
         super(HqCategory, self).__init__()
         self._category   = category
         self._activities = set()
+        self._dependents = dependents
 
     @pyqtSlot(result=str)
     def name(self):
@@ -128,20 +185,68 @@ class HqCategory(QObject):
     def activities(self):
       return self._activities
 
+    @pyqtSlot(result=int)
+    def dependents(self):
+      """ The number of activities of the category. """
+      return self._dependents
+
 
 class HamsterConfig():
     """ Configuration class for the Hamster Library
-        This class will most probrbaly be replaced by a ConfigParser class """
-
-    def __init__(self):
-        self._options = {
-            'store'          : 'sqlalchemy',
-            'daystart'       : '00:00:00',
-            'fact_min_delta' : '60',
-            'db_engine'      : 'sqlite',
-            'db_path'        : 'hamster_pyqt.sqlite',
-            'tmpfile_path'   : 'hamster_pyqt.fact'
-        }
+
+    The defaults can be changed in a configuration file, which is in turn
+    overridden by environment variables. The file is an INI file with the
+    options in a [hamster] section. It is read from the path in the
+    HAMSTER_QML_CONFIG environment variable, or from hamster_pyqt.conf in the
+    working folder if it exists. The environment variable of an option is its
+    name in capitals with a HAMSTER_QML_ prefix, for example
+    HAMSTER_QML_DB_PATH.
+
+    The sqlite_* and db_* options are used by the HamsterBackend to set up the
+    database connection, an empty value keeps the sqlite default. """
+
+    FILE       = 'hamster_pyqt.conf'
+    SECTION    = 'hamster'
+    ENV_PREFIX = 'HAMSTER_QML_'
+    DEFAULTS   = {
+        'store'               : 'sqlalchemy',
+        'daystart'            : '00:00:00',
+        'fact_min_delta'      : '60',
+        'db_engine'           : 'sqlite',
+        'db_path'             : 'hamster_pyqt.sqlite',
+        'tmpfile_path'        : 'hamster_pyqt.fact',
+        'journal_path'        : 'hamster_pyqt.journal', # Empty to apply start/stop/cancel directly
+        'db_keep_connection'  : 'yes',    # Keep one connection open instead of one per transaction
+        'db_indexes'          : 'yes',    # Create the indexes used by the range and overlap queries
+        'db_search'           : 'no',     # Keep a full-text index of the facts, needs sqlite FTS5
+        'db_changes'          : 'no',     # Log the changes to apply the changes of other applications
+        'sqlite_journal_mode' : 'wal',
+        'sqlite_synchronous'  : 'normal',
+        'sqlite_cache_size'   : '',       # Pages, or KiB if negative
+        'sqlite_mmap_size'    : '',       # Bytes
+    }
+    PATHS = ('db_path', 'tmpfile_path', 'journal_path')
+
+    def __init__(self, path = None, environ = None):
+        """ Read the configuration from the given file, or from the default
+        file if no path is given, and the environment. """
+        environ = os.environ if environ is None else environ
+        self._options = dict(self.DEFAULTS)
+        if path is None:
+            path = environ.get(self.ENV_PREFIX + 'CONFIG') or self.FILE
+            if not os.path.exists(path):
+                path = None
+        if path is not None:
+            parser = configparser.ConfigParser(interpolation=None)
+            with open(path) as file:
+                parser.read_file(file)
+            if parser.has_section(self.SECTION):
+                self._options.update(parser.items(self.SECTION))
+        for key in self.DEFAULTS:
+            if self.ENV_PREFIX + key.upper() in environ:
+                self._options[key] = environ[self.ENV_PREFIX + key.upper()]
+        for key in self.PATHS:
+            self._options[key] = os.path.expanduser(self._options[key])
 
     def get(self, key, default = ''):
         if key in self._options:
@@ -149,12 +254,30 @@ class HamsterConfig():
         else:
             return default;
 
+    def getBool(self, key, default = False):
+        value = self.get(key, None)
+        if value is None or value == '':
+            return default
+        return value.strip().lower() in ('1', 'yes', 'true', 'on')
+
     def __getitem__(self, key):
         return self.get(key)
 
 
 class HamsterPyQt(QObject):
-    """ Hamser interface """
+    """ Hamser interface
+
+    All the calls to the storage are done by a HamsterBackend on a worker
+    thread so that they never block the GUI. The slots queue a request for
+    the worker and return immediately, the signals are emitted on the GUI
+    thread when the request finished. Requests are handled in the order
+    they are made. Functions that return data from the storage take a
+    callback that is called with the data on the GUI thread.
+
+    If the interface is not threaded the requests are handled immediately,
+    this is meant for scripts and benchmarks that do not run an event loop.
+    The configuration is read by HamsterConfig unless one is given.
+    """
 
     currentUpdated    = pyqtSignal(FactPyQt, name='currentUpdated', arguments=['current'])
     errorMessage      = pyqtSignal('QString', name='errorMessage', arguments=['message'])
@@ -162,99 +285,376 @@ class HamsterPyQt(QObject):
     stopSuccessful    = pyqtSignal(name='stopSuccessful')
     factUpdated       = pyqtSignal(FactPyQt, name='factUpdated', arguments=['fact'])
     factAdded         = pyqtSignal(FactPyQt, name='factAdded', arguments=['fact'])
+    factsChanged      = pyqtSignal(object, object, name='factsChanged', arguments=['rows', 'removed'])
     categoriesChanged = pyqtSignal(name='categoriesChanged')
     activitiesChanged = pyqtSignal(name='activitiesChanged')
-
-    def __init__(self):
+    categoriesSynced  = pyqtSignal(name='categoriesSynced')
+    categoryAdded     = pyqtSignal(HqCategory, name='categoryAdded', arguments=['category'])
+    categoryRemoved   = pyqtSignal(int, name='categoryRemoved', arguments=['key'])
+    activityAdded     = pyqtSignal(HqActivity, name='activityAdded', arguments=['activity'])
+    activityRemoved   = pyqtSignal(int, name='activityRemoved', arguments=['key'])
+    importProgress    = pyqtSignal(int, int, int, name='importProgress', arguments=['imported', 'skipped', 'percent'])
+    factsImported     = pyqtSignal(int, int, QDate, QDate, name='factsImported',
+                                   arguments=['imported', 'skipped', 'first', 'last'])
+    exportProgress    = pyqtSignal(int, int, name='exportProgress', arguments=['exported', 'percent'])
+    factsExported     = pyqtSignal(int, 'QString', name='factsExported', arguments=['exported', 'path'])
+    _request          = pyqtSignal(int, str, object)
+    SYNC_INTERVAL     = 5000 # Milliseconds between the checks for changes of other applications
+
+    def __init__(self, threaded = True, config = None):
         super(HamsterPyQt, self).__init__()
-        self._config     = HamsterConfig()
-        self._control    = HamsterControl(self._config);
-        self.categories()
+        self._config     = config if config is not None else HamsterConfig()
+        self._worker     = HamsterWorker(HamsterBackend(self._config))
+        self._thread     = None
+        self._requests   = {} # Callbacks of the requests that did not finish yet
+        self._loadedFacts = None # Model with the loaded facts, see setLoadedFacts()
+        self._progress   = {} # Progress callbacks of the requests that did not finish yet
+        self._nextId     = 0
+        if threaded:
+            self._thread = QThread(self)
+            self._worker.moveToThread(self._thread)
+            self._request.connect(self._worker.run)
+            self._worker.finished.connect(self._finished)
+            self._worker.progress.connect(self._progressed)
+            self._thread.start()
+            if QCoreApplication.instance() is not None:
+                QCoreApplication.instance().aboutToQuit.connect(self.close)
+        # The ongoing fact is kept in memory and only read from the tmpfile
+        # when it is changed outside of this object, for example by another
+        # hamster frontend. Since the tmpfile is removed when the ongoing
+        # fact is stopped, its directory is watched as well.
+        self._current        = None
+        self._currentPyQt    = None
+        self._currentStat    = None
+        self._tmpFilePath    = os.path.abspath(self._config['tmpfile_path'])
+        self._tmpFileWatcher = QFileSystemWatcher(self)
+        self._tmpFileWatcher.addPath(os.path.dirname(self._tmpFilePath))
+        self._tmpFileWatcher.directoryChanged.connect(self._tmpFileChanged)
+        self._tmpFileWatcher.fileChanged.connect(self._tmpFileChanged)
+        # Starting, stopping and cancelling facts is journaled, see _journaled().
+        self._journal = None
+        if self._config['journal_path']:
+            self._journal = FactJournal(os.path.abspath(self._config['journal_path']))
+            self._replayJournal()
+        self._readCurrent()
+        # The changes that other applications make to the database are
+        # applied when the database files change, or at least every
+        # SYNC_INTERVAL, see syncChanges().
+        self._syncing    = False
+        self._syncAgain  = False
+        self._dbPath     = os.path.abspath(self._config['db_path'])
+        self._dbWatcher  = QFileSystemWatcher(self)
+        self._dbWatcher.fileChanged.connect(self.syncChanges)
+        self._syncTimer  = QTimer(self)
+        self._syncTimer.setInterval(HamsterPyQt.SYNC_INTERVAL)
+        self._syncTimer.timeout.connect(self.syncChanges)
+        if self._config.getBool('db_changes') and self._config['db_engine'] == 'sqlite':
+            self._watchDatabase()
+            self._syncTimer.start()
+
+    @pyqtSlot()
+    @instrumented
+    def close(self):
+        """ Stop the worker thread after the queued requests are handled. """
+        self._syncTimer.stop()
+        if self._thread is None:
+            self._wait('close')
+        elif self._thread.isRunning():
+            self._wait('close')
+            self._thread.quit()
+            self._thread.wait()
+        if self._journal is not None:
+            self._journal.close()
+
+    def _errorMessage(self, message):
+        # Callback for a failed request that reports the error.
+        return lambda err: self.errorMessage.emit(message.format(err))
+
+    def _call(self, name, args = (), done = None, failed = None, progress = None):
+        """ Request a call of the backend function with the given name.
+
+        When the call finished done is called with its result, or failed is
+        called with the exception it raised. Without a failed callback the
+        exception is reported with errorMessage. If a progress callback is
+        given, it is passed as the last argument to the backend function and
+        called on the GUI thread with the progress the function reports.
+        """
+        if failed is None:
+            failed = self._errorMessage("{0}")
+        if self._thread is None:
+            if progress is not None:
+                args = args + (progress,)
+            result, error = self._worker.call(name, args)
+            self._callback(done, failed, result, error)
+            return
+        request = self._nextId
+        self._nextId += 1
+        self._requests[request] = (done, failed)
+        if progress is not None:
+            self._progress[request] = progress
+            report = self._worker.progress.emit
+            args   = args + (lambda value: report(request, value),)
+        self._request.emit(request, name, args)
+
+    def _wait(self, name, *args):
+        """ Call the backend function and wait for the result. Only meant for
+        functions that must return a result immediately. """
+        if self._thread is None:
+            result, error = self._worker.call(name, args)
+        else:
+            self._request.emit(-1, name, args)
+            result, error = self._worker.replies.get()
+        if error is not None:
+            raise error
+        return result
+
+    @pyqtSlot(int, object, object)
+    @instrumented
+    def _finished(self, request, result, error):
+        done, failed = self._requests.pop(request)
+        self._progress.pop(request, None)
+        self._callback(done, failed, result, error)
+
+    @pyqtSlot(int, object)
+    @instrumented
+    def _progressed(self, request, value):
+        progress = self._progress.get(request)
+        if progress is not None:
+            progress(value)
+
+    def _callback(self, done, failed, result, error):
+        if error is not None:
+            failed(error)
+        elif done is not None:
+            done(result)
 
     def _cleanStart(self, start):
-        # Always update the start time to be on the minute with 10 seconds added.
-        # This overcomes the issue where facts are started without specifying
-        # a time that conflicts with one that was stopped by specifying a time.
-        # Sometimes there were a small overlap in seconds and the backend did
-        # not like this. This should ensure that this does not happen.
-        return start.replace(second=FACT_START_OFFSET, microsecond=0)
+        return cleanStart(start)
 
     def _cleanEnd(self, end):
-        # Update the stop time of the fact to always be on the minute.
-        # this will overcome the issue of stopping a fact and starting
-        # one for the same minute.
-        return end.replace(second=0, microsecond=0)
+        return cleanEnd(end)
+
+    def _tmpFileStat(self):
+        try:
+            stat = os.stat(self._tmpFilePath)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _setCurrent(self, fact, stat = None):
+        """ Update the cached ongoing fact and notify about the change. """
+        self._current     = fact
+        self._currentPyQt = FactPyQt(fact) if fact is not None else None
+        self._currentStat = stat if stat is not None else self._tmpFileStat()
+        # The watcher drops files that are removed, make sure the tmpfile is
+        # watched again once it exists.
+        if self._currentStat is not None and self._tmpFilePath not in self._tmpFileWatcher.files():
+            self._tmpFileWatcher.addPath(self._tmpFilePath)
+        self.current()
+
+    def _journaled(self, op, data, done, failed):
+        """ Apply a change to the ongoing fact, see HamsterBackend.applyJournal().
+
+        The change is appended to the journal before it is queued for the
+        storage, so that the interface can be updated right away. The change
+        is marked as done by the worker when it was applied, changes that were
+        not applied when the application stopped are applied when it starts
+        again.
+        """
+        if self._journal is None:
+            self._call('applyJournal', (op, data), done, failed)
+            return
+        id = self._journal.append(op, data)
+        self._call('applyJournal', (op, data, lambda: self._journal.done(id)), done, failed)
+
+    def _replayJournal(self):
+        # Apply the changes that were not applied when the application
+        # stopped, applying a change again is harmless.
+        for id, op, data in self._journal.pending():
+            self._call('applyJournal', (op, data, lambda id = id: self._journal.done(id)), None,
+                       self._errorMessage("Journal error: {0}"))
+
+    def _readCurrent(self):
+        """ Read the ongoing fact from the tmpfile. """
+        stat = self._tmpFileStat()
+        self._call('tmpFact', (), lambda fact: self._setCurrent(fact, stat))
 
     @pyqtSlot()
-    def list(self, start_time = '', end_time = ''):
-        """ List all facts that are between the supplied start and end times. """
-        if start_time and end_time:
-            print('Listing:  %s - %s' % (start_time, end_time) )
-        elif start_time:
-            print('Listing: %s' % (start_time) )
-        else:
-            factsPyQt = []
-            facts = self._control.facts.get_all()
-            for fact in facts:
-                # Convert the hamster-lib fact to a PyQt fact
-                factPyQt = FactPyQt(fact)
-                factsPyQt.append(factPyQt)
-            return factsPyQt
+    @instrumented
+    def _tmpFileChanged(self):
+        # All changes in the directory of the tmpfile are reported, only
+        # read the tmpfile if it changed since it was last seen.
+        if self._tmpFileStat() != self._currentStat:
+            self._readCurrent()
+
+    def _watchDatabase(self):
+        # Watch the database and its write-ahead log. The log is created when
+        # the database is opened and can be removed when it is closed, the
+        # watcher drops files that are removed.
+        watched = self._dbWatcher.files()
+        for path in (self._dbPath, self._dbPath + '-wal'):
+            if path not in watched and os.path.exists(path):
+                self._dbWatcher.addPath(path)
 
     @pyqtSlot()
-    def categories(self):
-      categories  = self._control.categories.get_all()
-      categoryDic = {}
-      categoryDic[None] = HqCategory()
-      for cat in categories:
-        categoryDic[cat] = HqCategory(cat)
-      activities  = self._control.activities.get_all()
-      for act in activities:
-        cat = act.category
-        categoryDic[cat].addActivity(HqActivity(act))
-      return categoryDic
+    @instrumented
+    def syncChanges(self):
+        """ Apply the changes that other applications made to the database.
+
+        The changes since the last sync are read from the change log of the
+        database, see HamsterBackend.changes(). The facts that changed in the
+        days of the loaded facts are reported with factsChanged, changes to
+        the activities and categories with categoriesSynced. Only one sync
+        is queued at a time.
+        """
+        if self._syncing:
+            self._syncAgain = True
+            return
+        self._syncing = True
+        first = None
+        if self._loadedFacts is not None:
+            first = self._loadedFacts.loadedFrom().toPyDate()
+        def failed(err):
+            self._syncing = False
+            self.errorMessage.emit('Sync error: {0}'.format(err))
+        self._call('changes', (first,), self._changesSynced, failed)
+
+    def _changesSynced(self, changes):
+        self._syncing = False
+        self._watchDatabase()
+        if changes is not None:
+            rows, removed, categories = changes
+            if rows is None or rows or removed:
+                self.factsChanged.emit(rows, removed)
+            if categories:
+                self.categoriesSynced.emit()
+        if self._syncAgain:
+            self._syncAgain = False
+            self.syncChanges()
+
+    def backendTimings(self):
+        """ The seconds taken by the initialisation steps of the backend, see
+        HamsterBackend.timings(). Waits for the queued requests. """
+        return self._wait('timings')
+
+    def factRows(self, start_time, end_time, callback):
+        """ Get the facts for the days between the supplied start and end times
+        as tuples of (key, start, end, activity, category, description), see
+        HamsterBackend.factRows(). """
+        self._call('factRows', (start_time, end_time), callback)
+
+    def pageStart(self, before, count, callback):
+        """ Get the first day of the page of facts before the given day, see
+        HamsterBackend.pageStart(). """
+        self._call('pageStart', (before, count), callback)
+
+    def loadFacts(self, loadedFrom, count, callback):
+        """ See HamsterBackend.loadFacts(). """
+        self._call('loadFacts', (loadedFrom, count), callback)
+
+    def loadDays(self, first, last, callback):
+        """ See HamsterBackend.loadDays(). """
+        self._call('loadDays', (first, last), callback)
+
+    def loadPage(self, before, count, callback):
+        """ See HamsterBackend.loadPage(). """
+        self._call('loadPage', (before, count), callback)
+
+    def list(self, start_time, end_time, callback):
+        """ List all facts for the days between the supplied start and end times.
+
+        Both times are optional and inclusive; a missing start or end time leaves
+        that side of the range open. The callback is called with the list of
+        FactPyQt objects.
+        """
+        self._call('facts', (start_time, end_time),
+                   lambda facts: callback([FactPyQt(fact) for fact in facts]))
+
+    def categories(self, callback):
+      """ Get the categories with their activities. The callback is called with
+      a dictionary of the HqCategory objects by the hamster-lib categories. """
+      def done(result):
+        categories, activities, factCounts, activityCounts = result
+        categoryDic = {}
+        categoryDic[None] = HqCategory(None, activityCounts.get(-1, 0))
+        for cat in categories:
+          categoryDic[cat] = HqCategory(cat, activityCounts.get(cat.pk, 0))
+        for act in activities:
+          cat = act.category
+          categoryDic[cat].addActivity(HqActivity(act, factCounts.get(act.pk, 0)))
+        callback(categoryDic)
+      self._call('categories', (), done)
+
+    def setLoadedFacts(self, model):
+        """ Set the model with the loaded facts, see FactModelPyQt.
+
+        Facts are checked for overlaps with the loaded facts before they are
+        saved, so that the overlaps are reported without a request to the
+        storage. The storage still checks the facts of the other days.
+        """
+        self._loadedFacts = model
+
+    def _overlap(self, start, end, key = None):
+        # Describe the loaded fact that a fact from start to end would overlap,
+        # None if it does not overlap a loaded fact.
+        if self._loadedFacts is None:
+            return None
+        facts = self._loadedFacts.overlappingFacts(start, end, key)
+        if not facts:
+            return None
+        values = facts[0]
+        return 'The fact overlaps with {0}@{1} from {2:%Y-%m-%d %H:%M} to {3:%H:%M}'.format(
+            values[5], values[6], datetime.datetime.fromtimestamp(values[1]),
+            datetime.datetime.fromtimestamp(values[2]))
 
     @pyqtSlot('QString')
+    @instrumented
     def start(self, command):
         """ Start a fact """
         if not command:
             self.errorMessage.emit('Empty fact information, can\'t start fact.')
             return
 
-        # Some basic handling
-        # If the command has a comma but no @, add the @ since comma is for comment
-        if ( ',' in command ) and ( not '@' in command ):
-            command = command.replace( ',', '@,' )
-
-        fact = Fact.create_from_raw_fact(command)
+        fact = fact_import.rawFact(command)
         if not fact.start:
             # No start time for the fact, set to now
             fact.start = datetime.datetime.now()
         # Clean up the fact start as per the hamster-QML interface.
         fact.start = self._cleanStart(fact.start)
+        # An ongoing fact runs up to now.
+        overlap = self._overlap(fact.start, fact.end or datetime.datetime.now())
+        if overlap:
+            self.errorMessage.emit("Fact start error: {0}".format(overlap))
+            return
         # Save the fact. If the fact does not have an end time it will be set as the
-        # current fact.
-
-        # At this point first check if there is not alreay a fact ongoing,
-        # if there it, it must be stopped with the stop time set to before
-        # the stop time of the ongoing fact.
-        self.stop(fact.start, True)
-
-        try:
-            fact = self._control.facts.save(fact)
-        except ValueError as err:
-            self.errorMessage.emit("Fact start error: {0}".format(err))
-        else:
-            self.startSuccessful.emit()
+        # current fact. An ongoing fact is stopped before the fact starts, see
+        # HamsterBackend.applyJournal(). The fact is shown right away, the
+        # storage saves it in the background.
+        self.startSuccessful.emit()
+        if not fact.end:
+            self._setCurrent(fact)
+
+        def started(result):
+            stopped, fact = result
+            if stopped:
+                self.factAdded.emit(FactPyQt(stopped))
             # Check if the started fact has a end time. If it does have one, a
             # start and end time was specified and the fact was added to the
             # database. If it does not have a end it is an ongoing fact.
             if fact.end:
                 self.factAdded.emit(FactPyQt(fact))
-        self.current()
+                if stopped:
+                    self._setCurrent(None)
+            else:
+                self._setCurrent(fact)
+        def failed(err):
+            self.errorMessage.emit("Fact start error: {0}".format(err))
+            self._readCurrent()
+        self._journaled('start', factData(fact), started, failed)
 
 
     @pyqtSlot(QDateTime, QDateTime, 'QString', 'QString', 'QString')
+    @instrumented
     def create(self, start, end, activity, category, description):
         """ Create a fact for the given date """
         command = activity
@@ -266,140 +666,177 @@ class HamsterPyQt(QObject):
 
         fact.start = self._cleanStart(start.toPyDateTime())
         fact.end   = self._cleanEnd(end.toPyDateTime())
-        try:
-           fact = self._control.facts.save(fact)
-        except ValueError as err:
-            self.errorMessage.emit("Fact error: {0}".format(err))
-        else:
-            self.factAdded.emit(FactPyQt(fact))
+        overlap = self._overlap(fact.start, fact.end)
+        if overlap:
+            self.errorMessage.emit("Fact error: {0}".format(overlap))
+            return
+        self._call('save', (fact,), lambda fact: self.factAdded.emit(FactPyQt(fact)),
+                   self._errorMessage("Fact error: {0}"))
 
 
     @pyqtSlot()
+    @instrumented
     def stop(self, endTime = None, ignoreError=False):
         """ Stop an ongoing fact """
-        try:
-            fact = self._control.facts.stop_tmp_fact()
-        except ValueError as err:
+        # If the end time is supplied, use the supplied time instead of
+        # the time the fact is stopped. Make the end time clean according
+        # what is required for this app.
+        if not endTime:
+            endTime = datetime.datetime.now()
+        endTime = self._cleanEnd(endTime)
+
+        # The fact is stopped right away, the storage saves it in the background.
+        self.stopSuccessful.emit()
+        self._setCurrent(None)
+
+        def stopped(fact):
+            # There is no fact if there was no ongoing fact to stop.
+            if fact is not None:
+                self.factAdded.emit(FactPyQt(fact))
+            self._setCurrent(None)
+
+        def failed(err):
             if ignoreError == False:
                 self.errorMessage.emit("Fact stop error: {0}".format(err))
-            self.current()
-            return
-        # If the end time is supplied, update the end time to the
-        # supplied time instead of using the end time obtained from
-        # the fact stop.
-        if endTime:
-            fact.end = endTime
-        # Make the end time clean according what is required for this app.
-        fact.end = self._cleanEnd(fact.end)
-        try:
-            self._control.facts.save(fact)
-        except ValueError as err:
-            self.errorMessage.emit("Fact stop error: {0}".format(err))
-            self.current()
-            return
-        # At this point adding the fact should have been successful.
-        self.stopSuccessful.emit()
-        self.factAdded.emit(FactPyQt(fact))
-        self.current()
+            self._readCurrent()
+        self._journaled('stop', dict(end=endTime.isoformat()), stopped, failed)
 
     @pyqtSlot()
+    @instrumented
     def cancel(self):
         """ Cancel an ongoing fact """
-        try:
-            self._control.facts.cancel_tmp_fact()
-        except KeyError:
-            print('No fact to cancel')
-
-        self.current()
+        self._setCurrent(None)
+        def failed(err):
+            self.errorMessage.emit("Fact cancel error: {0}".format(err))
+            self._readCurrent()
+        self._journaled('cancel', {}, lambda result: self._setCurrent(None), failed)
 
     @pyqtSlot()
+    @instrumented
     def current(self):
-        """ List the current active fact """
-        try:
-            fact = self._control.facts.get_tmp_fact()
-        except KeyError:
-            self.currentUpdated.emit(None);
-        else:
-            fact.end = datetime.datetime.now()
-            string = '{fact} ({duration} minutes)'.format(fact=fact, duration=fact.get_string_delta())
-            self.currentUpdated.emit(FactPyQt(fact));
+        """ Notify about the current active fact.
+
+        The ongoing fact is cached, use refreshCurrent() to read it again.
+        """
+        self.currentUpdated.emit(self._currentPyQt);
+
+    @pyqtSlot()
+    @instrumented
+    def refreshCurrent(self):
+        """ Read the current active fact again and notify about it. """
+        self._readCurrent()
 
     @pyqtSlot(int, 'QDateTime', 'QDateTime', 'QString', 'QString', 'QString')
+    @instrumented
     def updateFact(self, key, startTime, endTime, activity, category, description):
-        # get the fact from the Fact Manager
-        try:
-            fact = self._control.facts.get(key)
-        except KeyError:
-            self.errorMessage.emit('Invalid key passed to updateFact() function.')
-            return
-
-        # Check the category. An empty category is accepted by the backend
-        # but it can not have an empty name, it must be 'None' instead.
-        cat = None
-        if category:
-            cat = Category(category)
-        fact.start       = self._cleanStart(startTime.toPyDateTime())
-        fact.end         = self._cleanEnd(endTime.toPyDateTime())
-        fact.activity    = Activity(activity, category=cat)
-        fact.description = description
-        # Save the updated fact
-        try:
-            self._control.facts.save(fact)
-            self.factUpdated.emit(FactPyQt(fact))
-        except ValueError as err:
-            self.errorMessage.emit("Could not update fact: {0}".format(err))
+        def failed(err):
+            if isinstance(err, KeyError):
+                self.errorMessage.emit('Invalid key passed to updateFact() function.')
+            else:
+                self.errorMessage.emit("Could not update fact: {0}".format(err))
+        start   = self._cleanStart(startTime.toPyDateTime())
+        end     = self._cleanEnd(endTime.toPyDateTime())
+        overlap = self._overlap(start, end, key)
+        if overlap:
+            failed(overlap)
             return
+        self._call('updateFact', (key, start, end, activity, category, description),
+                   lambda fact: self.factUpdated.emit(FactPyQt(fact)), failed)
 
     @pyqtSlot(int)
+    @instrumented
     def removeCategory(self, pk):
-      if int(pk) == -1:
-        return
-      category = self._control.categories.get( pk )
-      if category is None:
+      pk = int(pk)
+      if pk == -1:
         return
-      self._control.categories.remove( category )
-      self.categoriesChanged.emit()
+      def removed(removed):
+        if removed:
+          self.categoryRemoved.emit(pk)
+          self.categoriesChanged.emit()
+      self._call('removeCategory', (pk,), removed)
 
     @pyqtSlot(int)
+    @instrumented
     def removeActivity(self, pk):
-      activity = self._control.activities.get( pk )
-      rawActivity = self._control.activities.get( pk, raw=True )
-      if activity is None:
-        return
-      self._control.activities.remove( activity )
-      self.activitiesChanged.emit()
-
-    @pyqtSlot(int, result=bool)
-    def canRemoveCategory(self, pk):
-      if int(pk) == -1:
-        return False
-      # Get the category and then get the raw category using the
-      # get_by_name() function. The CategoryManager does not have
-      # a get( pk, raw ) function like the ActivityManager.
-      # Using the raw objects is easier than finding the
-      # number of associted activities manually.
-      category = self._control.categories.get( pk )
-      if category is None:
-        return
-      rawCategory = self._control.categories.get_by_name( category.name, raw=True )
-      return len( rawCategory.activities ) == 0
-
-    @pyqtSlot(int, result=bool)
-    def canRemoveActivity(self, pk):
-      rawActivity = self._control.activities.get( pk, raw=True )
-      return len( rawActivity.facts ) == 0
-
-    @pyqtSlot(str, str, result=bool)
+      pk = int(pk)
+      def removed(removed):
+        if removed:
+          self.activityRemoved.emit(pk)
+          self.activitiesChanged.emit()
+      self._call('removeActivity', (pk,), removed)
+
+    def dependencyCounts(self, callback):
+      """ Get the number of facts per activity and activities per category,
+      see HamsterBackend.dependencyCounts(). """
+      self._call('dependencyCounts', (), callback)
+
+    def search(self, text, start_time, end_time, callback):
+      """ Find the facts that match the text, see HamsterBackend.search(). The
+      callback is called with the keys and the first day of the facts. """
+      self._call('search', (text, start_time, end_time), callback)
+
+    def history(self, callback):
+      """ Get the number of facts per activity and description, see
+      HamsterBackend.history(). """
+      self._call('history', (), callback)
+
+    @pyqtSlot(str)
+    @pyqtSlot(str, str)
+    @instrumented
+    def importFacts(self, path, format = ''):
+        """ Import the facts from a file, see HamsterBackend.importFacts().
+
+        The path can be a local file URL. Without a format the format is taken
+        from the file extension, see fact_import.FORMATS. The progress is
+        reported with importProgress and the result with factsImported.
+        """
+        if path.startswith('file:'):
+            path = QUrl(path).toLocalFile()
+        if not format:
+            format = fact_import.fileFormat(path)
+        def imported(result):
+            imported, skipped, first, last = result
+            self.factsImported.emit(imported, skipped, QDate(first) if first else QDate(),
+                                    QDate(last) if last else QDate())
+        self._call('importFacts', (path, format), imported, self._errorMessage("Fact import error: {0}"),
+                   lambda progress: self.importProgress.emit(*progress))
+
+    @pyqtSlot(str, QDate, QDate)
+    @pyqtSlot(str, QDate, QDate, str)
+    @instrumented
+    def exportFacts(self, path, start, end, format = ''):
+        """ Export the facts of the days from start up to and including end to
+        a file, see HamsterBackend.exportFacts().
+
+        An invalid start or end date leaves that side of the range open. The
+        path can be a local file URL. Without a format the format is taken
+        from the file extension, see fact_export.FORMATS. The progress is
+        reported with exportProgress and the result with factsExported.
+        """
+        if path.startswith('file:'):
+            path = QUrl(path).toLocalFile()
+        if not format:
+            format = fact_export.fileFormat(path)
+        self._call('exportFacts', (path, format, start.toPyDate() if start.isValid() else None,
+                                   end.toPyDate() if end.isValid() else None),
+                   lambda exported: self.factsExported.emit(exported, path),
+                   self._errorMessage("Fact export error: {0}"),
+                   lambda progress: self.exportProgress.emit(*progress))
+
+    @pyqtSlot(str, str)
+    @instrumented
     def addActivity(self, activityName, categoryName):
+      """ Add the activity and its category. The category and activity are
+      reported with categoryAdded and activityAdded, also when they already
+      existed. """
       activityName = activityName.strip()
       categoryName = categoryName.strip()
-
-      category = None
-      activity = None
-      if categoryName != "" and categoryName != "(uncategorised)":
-        category = self._control.categories.get_or_create(Category(categoryName))
-
-      if activityName != "":
-        activity = self._control.activities.get_or_create(Activity(activityName, category=category))
-
-      return category is not None or activity is not None
+      def added(result):
+        category, activity = result
+        if category is not None:
+          self.categoryAdded.emit(HqCategory(category))
+          self.categoriesChanged.emit()
+        if activity is not None:
+          self.activityAdded.emit(HqActivity(activity))
+          self.activitiesChanged.emit()
+      self._call('addActivity', (activityName, categoryName), added)
@@ -0,0 +1,154 @@
+##########################################################################
+##
+## Copyright (c) 2017 Carel Combrink
+##
+## This file is part of the Hamster QML GUI, a QML GUI for the hamster-lib.
+##
+## The Hamster QML GUI is free software: you can redistribute it and/or
+## modify it under the terms of the GNU Lesser General Public License as
+## published by the Free Software Foundation, either version 3 of the
+## License, or (at your option) any later version.
+##
+## The Hamster QML GUI is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU Lesser General Public License for more details.
+##
+## You should have received a copy of the GNU Lesser General Public License
+## along with the Hamster QML GUI. If not, see <http://www.gnu.org/licenses/>.
+############################################################################
+import os
+import sys
+import json
+import time
+import threading
+import functools
+
+from PyQt5.QtCore import QObject, QVariant, pyqtProperty, pyqtSlot
+
+def _setting():
+    # The --instrument[=<file>] argument or the HAMSTER_QML_INSTRUMENT
+    # environment variable, None when not given.
+    for arg in sys.argv:
+        if arg == '--instrument' or arg.startswith('--instrument='):
+            return arg.partition('=')[2] or '1'
+    return os.environ.get('HAMSTER_QML_INSTRUMENT') or None
+
+# Instrumentation is enabled at startup, functions are only instrumented when
+# it is enabled so that there is no overhead when it is not.
+ENABLED = _setting() is not None
+
+def dumpPath():
+    """ The file to dump the statistics to at exit, None if not given. The
+    file is the value of the argument or environment variable, if it is not
+    just a flag. """
+    setting = _setting()
+    if setting is None or setting.lower() in ('1', 'true', 'yes', 'on'):
+        return None
+    return setting
+
+class Histogram():
+    """ Call count and latency histogram of a function.
+
+    The latencies are counted in buckets of powers of two microseconds,
+    bucket n counts the calls that took less than 2^n microseconds. The
+    buckets are reported as [upper bound, count] pairs, also to QML.
+    """
+    __slots__ = ('count', 'total', 'maximum', 'buckets')
+
+    def __init__(self):
+        self.count   = 0
+        self.total   = 0 # nanoseconds
+        self.maximum = 0
+        self.buckets = []
+
+    def add(self, nanoseconds):
+        self.count += 1
+        self.total += nanoseconds
+        if nanoseconds > self.maximum:
+            self.maximum = nanoseconds
+        bucket = (nanoseconds // 1000).bit_length()
+        if bucket >= len(self.buckets):
+            self.buckets.extend([0] * (bucket + 1 - len(self.buckets)))
+        self.buckets[bucket] += 1
+
+    def percentile(self, fraction):
+        """ The upper bound in milliseconds of the bucket with the given fraction of the calls. """
+        needed = fraction * self.count
+        seen   = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if seen >= needed:
+                return (1 << bucket) / 1000
+        return 0
+
+    def stats(self):
+        return dict(count=self.count, total_ms=self.total / 1e6,
+                    mean_ms=self.total / 1e6 / self.count if self.count else 0,
+                    max_ms=self.maximum / 1e6, p50_ms=self.percentile(0.5),
+                    p95_ms=self.percentile(0.95), p99_ms=self.percentile(0.99),
+                    buckets_us=[ [1 << bucket, count] for bucket, count in enumerate(self.buckets) if count ])
+
+_histograms = {}
+_lock       = threading.Lock() # Functions are called on the GUI and the worker threads.
+
+def record(name, nanoseconds):
+    """ Record a call of the named function that took the given time. """
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram()
+        histogram.add(nanoseconds)
+
+def instrumented(function):
+    """ Decorator that records the calls of the function if instrumentation is
+    enabled, the function is returned as is if it is not. For slots this must
+    be the innermost decorator. """
+    if not ENABLED:
+        return function
+    name = function.__qualname__
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter_ns()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            record(name, time.perf_counter_ns() - start)
+    return wrapper
+
+def snapshot():
+    """ The statistics of the functions by name. """
+    with _lock:
+        return { name: histogram.stats() for name, histogram in _histograms.items() }
+
+def reset():
+    with _lock:
+        _histograms.clear()
+
+def dump(path):
+    """ Write the statistics to a JSON file. """
+    with open(path, 'w') as file:
+        json.dump(dict(date=time.strftime('%Y-%m-%dT%H:%M:%S'), functions=snapshot()),
+                  file, indent=2, sort_keys=True)
+
+
+class HqStats(QObject):
+    """ The instrumentation statistics for QML, see instrumentation. """
+
+    @pyqtProperty(bool, constant=True)
+    def enabled(self):
+        return ENABLED
+
+    @pyqtSlot(result=QVariant)
+    def snapshot(self):
+        """ The statistics of the instrumented functions by name. """
+        return QVariant(snapshot())
+
+    @pyqtSlot()
+    def reset(self):
+        reset()
+
+    @pyqtSlot(str)
+    def dump(self, path):
+        """ Write the statistics to a JSON file. """
+        dump(path)
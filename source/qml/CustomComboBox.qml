@@ -20,6 +20,9 @@ ComboBox {
   property alias selectByMouse: text_.selectByMouse
   property bool showAcceptable: false
 
+  /* Emitted when the text is edited by the user, not when it is set. */
+  signal textEdited(string text)
+
   /* Interesting way to overlay an item on top of the
    * text field to allow changing the border color without
    * the need to change the contentItem since the TextField
@@ -45,6 +48,7 @@ ComboBox {
     readOnly: root_.down
     inputMethodHints: root_.inputMethodHints
     validator: root_.validator
+    onTextEdited: root_.textEdited(text)
 
     font: root_.font
     color: root_.editable ? root_.palette.text : root_.palette.buttonText
@@ -42,6 +42,9 @@ Window {
 
   property int margin: 10
 
+  /* The loaded facts that the fact would overlap with the times entered. */
+  property var conflicts: py.fact_model.conflicts(timeEditStart.dateTime, timeEditEnd.dateTime, key)
+
   signal accepted(int key, date start, date end, string category, string activity, string description)
 
   function clearAll() {
@@ -124,6 +127,17 @@ Window {
         }
       }
     }
+    Label {
+      id: labelConflict_
+      visible: conflicts.length > 0
+      text: conflicts.length > 0 ? "Overlaps with " + conflicts[0].activity + "@" + conflicts[0].category
+                                   + " from " + Qt.formatDateTime(conflicts[0].start, "hh:mm")
+                                   + " to " + Qt.formatDateTime(conflicts[0].end, "hh:mm")
+                                 : ""
+      font.italic: true
+      color: "red"
+      Layout.fillWidth: true
+    }
     Rectangle {
       height: 30
       Layout.fillWidth: true
@@ -135,6 +149,7 @@ Window {
           enabled: (timeEditStart.busyEditing == false)
                    && (timeEditEnd.busyEditing == false)
                    && (factEditor_.valid == true)
+                   && (conflicts.length == 0)
           onClicked: {
             root_.accepted(key
                            , timeEditStart.dateTime
@@ -48,6 +48,70 @@ Item {
     comboActivity_.currentIndex = idx
   }
 
+  /* Fill in a suggestion from the history, the activity and category
+   * are only changed if no activity was entered yet. */
+  function applySuggestion( suggestion ) {
+    if( comboActivity_.editText === "" ) {
+      setCategory( suggestion.category )
+      setActivity( suggestion.activity )
+    }
+    textDescription_.text = suggestion.description
+    suggestions_.close()
+  }
+
+  /* Suggest activity@category pairs from the history while an activity
+   * or a category is typed, the best ranked pairs are shown first. */
+  function suggestActivities( text ) {
+    activitySuggestionList_.model        = text ? py.fact_history.activities( text, 8 ) : []
+    activitySuggestionList_.currentIndex = -1
+    if( activitySuggestionList_.count > 0 ) {
+      activitySuggestions_.open()
+    } else {
+      activitySuggestions_.close()
+    }
+  }
+
+  /* Fill in the activity and category of a suggested pair. */
+  function applyActivitySuggestion( suggestion ) {
+    if( suggestion.category === "" ) {
+      comboCategory_.currentIndex = -1
+      comboCategory_.editText     = ""
+    } else {
+      setCategory( suggestion.category )
+      if( comboCategory_.editText !== suggestion.category ) {
+        comboCategory_.editText = suggestion.category
+      }
+    }
+    setActivity( suggestion.activity )
+    if( comboActivity_.editText !== suggestion.activity ) {
+      comboActivity_.editText = suggestion.activity
+    }
+    activitySuggestions_.close()
+    textDescription_.focus = true
+  }
+
+  /* Handle the keys that select a suggested pair, returns if the key
+   * was handled. */
+  function activitySuggestionKey( event ) {
+    if( !activitySuggestions_.opened ) {
+      return false
+    }
+    if( event.key == Qt.Key_Down ) {
+      activitySuggestionList_.incrementCurrentIndex()
+    } else if( event.key == Qt.Key_Up ) {
+      activitySuggestionList_.decrementCurrentIndex()
+    } else if( ( ( event.key == Qt.Key_Enter ) || ( event.key == Qt.Key_Return ) )
+               && activitySuggestionList_.currentIndex >= 0 ) {
+      applyActivitySuggestion( activitySuggestionList_.model[activitySuggestionList_.currentIndex] )
+    } else if( event.key == Qt.Key_Escape ) {
+      activitySuggestions_.close()
+    } else {
+      return false
+    }
+    event.accepted = true
+    return true
+  }
+
   RowLayout {
     id: controlFactNew_
     anchors.fill: parent
@@ -72,7 +136,11 @@ Item {
             currentIndex = -1
           }
         }
+        onTextEdited: root_.suggestActivities( text )
         Keys.onPressed: {
+          if( root_.activitySuggestionKey( event ) ) {
+            return
+          }
           if( event.key == Qt.Key_At) {
             event.accepted = true
             comboActivity_.focus = true
@@ -103,14 +171,43 @@ Item {
         placeholderText: "[activity]"
         selectByMouse: true
         validator: RegExpValidator { regExp: /^[A-Za-z0-9_-]+$/ }
-        model: py.category_model.activitiesList(comboCategory_.currentText, true)
+        /* Depend on the revision so that the list is updated when the activities change. */
+        model: {
+          py.category_model.revision
+          return py.category_model.activitiesList(comboCategory_.currentText, true)
+        }
         showAcceptable: comboCategory_.editText != ""
+        onTextEdited: root_.suggestActivities( text )
         Keys.onPressed: {
+          if( root_.activitySuggestionKey( event ) ) {
+            return
+          }
           if( event.key == Qt.Key_Comma) {
             event.accepted = true
             textDescription_.focus = true
           }
         }
+
+        Popup {
+          id: activitySuggestions_
+          y: parent.height
+          width: Math.max( parent.width, 200 )
+          height: contentItem.implicitHeight + topPadding + bottomPadding
+          padding: 1
+          closePolicy: Popup.CloseOnEscape | Popup.CloseOnPressOutsideParent
+
+          contentItem: ListView {
+            id: activitySuggestionList_
+            implicitHeight: contentHeight
+            clip: true
+            delegate: ItemDelegate {
+              width: activitySuggestionList_.width
+              text: modelData.text
+              highlighted: ListView.isCurrentItem
+              onClicked: root_.applyActivitySuggestion( modelData )
+            }
+          }
+        }
       }
     }
     ColumnLayout {
@@ -136,13 +233,59 @@ Item {
         Layout.fillWidth: true
         placeholderText: "description"
         selectByMouse: true
+        onTextEdited: {
+          /* Suggest descriptions from the history while typing. */
+          suggestionList_.model        = text ? py.fact_history.descriptions( text, 8 ) : []
+          suggestionList_.currentIndex = -1
+          if( suggestionList_.count > 0 ) {
+            suggestions_.open()
+          } else {
+            suggestions_.close()
+          }
+        }
         Keys.onPressed: {
-          if ( ( event.key == Qt.Key_Enter ) || ( event.key == Qt.Key_Return ) ){
+          if( suggestions_.opened && ( event.key == Qt.Key_Down ) ) {
+            event.accepted = true;
+            suggestionList_.incrementCurrentIndex()
+          } else if( suggestions_.opened && ( event.key == Qt.Key_Up ) ) {
             event.accepted = true;
-            root_.accepted()
+            suggestionList_.decrementCurrentIndex()
+          } else if ( ( event.key == Qt.Key_Enter ) || ( event.key == Qt.Key_Return ) ){
+            event.accepted = true;
+            if( suggestions_.opened && suggestionList_.currentIndex >= 0 ) {
+              root_.applySuggestion( suggestionList_.model[suggestionList_.currentIndex] )
+            } else {
+              suggestions_.close()
+              root_.accepted()
+            }
           } else if( event.key == Qt.Key_Escape ) {
             event.accepted = true;
-            root_.clearRequested()
+            if( suggestions_.opened ) {
+              suggestions_.close()
+            } else {
+              root_.clearRequested()
+            }
+          }
+        }
+
+        Popup {
+          id: suggestions_
+          y: parent.height
+          width: parent.width
+          height: contentItem.implicitHeight + topPadding + bottomPadding
+          padding: 1
+          closePolicy: Popup.CloseOnEscape | Popup.CloseOnPressOutsideParent
+
+          contentItem: ListView {
+            id: suggestionList_
+            implicitHeight: contentHeight
+            clip: true
+            delegate: ItemDelegate {
+              width: suggestionList_.width
+              text: modelData.description + "  (" + modelData.activity + "@" + modelData.category + ")"
+              highlighted: ListView.isCurrentItem
+              onClicked: root_.applySuggestion( modelData )
+            }
           }
         }
       }
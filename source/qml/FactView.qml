@@ -25,6 +25,9 @@ import QtQuick.Layouts 1.12
 Item {
   id: root
   property alias model: factView.model
+  /* Fetch older facts when the view is scrolled to the top. Views that
+   * show a fixed range of days, like today, leave this off. */
+  property bool pagesOlder: false
 
   TableView {
     id: factView
@@ -82,6 +85,18 @@ Item {
       py.hamster_lib.updateFact(key, start, end, activity, category, description);
     }
 
+    /* The oldest facts are shown at the top. When the view is scrolled
+     * to the top, ask the model for the next page of older facts. A model
+     * with a start date moves its start date back to show them. */
+    Connections {
+      target: factView.flickableItem
+      onAtYBeginningChanged: {
+        if (root.pagesOlder && factView.flickableItem.atYBeginning && factView.model.fetchOlder) {
+          factView.model.fetchOlder()
+        }
+      }
+    }
+
     Component {
       id: daySectionHeading
       Rectangle {
@@ -101,7 +116,11 @@ Item {
           }
 
           Text {
-            text: "(" + Qt.formatTime( py.fact_model.getDayTotal( section ), "hh:mm") + ")"
+            /* Depend on the revision so that the total is updated when it changes. */
+            text: {
+              py.fact_model.totals.revision
+              return "(" + py.fact_model.totals.format( py.fact_model.totals.total("day", section) ) + ")"
+            }
             font: textDate.font
             horizontalAlignment: Text.AlignRight
             Layout.fillWidth: true
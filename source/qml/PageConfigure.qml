@@ -103,16 +103,10 @@ Item {
               icon.color: enabled? "transparent": "lightgray"
               enabled: false
               onClicked:  {
-                // Get reference to the parent to try and expand it
-                // once the model gets updated. This is probably not
-                // the best idea since the model will be reset.
-                // For now it works
-                var p = tree_.currentIndex.parent
+                // Only the row of the item is removed from the model,
+                // the other items stay expanded.
                 tree_.model.removeItem( tree_.currentIndex )
                 enabled = false
-                if( p ) {
-                  tree_.expand(p)
-                }
               }
             }
             Item {
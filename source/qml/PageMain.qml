@@ -33,9 +33,24 @@ Item {
 
   property int margin: 11
 
+  /* The ongoing fact as last reported by the backend. The backend only
+   * reports it when it changes, the elapsed time is updated locally. */
+  property var currentFact: null
+
+  function updateCurrentText() {
+    if(currentFact != null) {
+      var elapsed = Math.floor(currentFact.elapsed() / 60)
+      var hours   = Math.floor(elapsed / 60)
+      var minutes = elapsed % 60
+      textFieldCurrent.text = Qt.formatDateTime(currentFact.start(), "hh:mm") + " " + currentFact.activity() + "@" + currentFact.category() + " " + currentFact.description()
+          + " (" + (hours < 10 ? "0" : "") + hours + ":" + (minutes < 10 ? "0" : "") + minutes + ")"
+    } else {
+      textFieldCurrent.text = ""
+    }
+  }
+
   Component.onCompleted: {
     py.hamster_lib.current()
-    currentTimer.running = true
   }
 
   ColumnLayout {
@@ -74,7 +89,7 @@ Item {
         Button {
           id: buttonCurrentRefresh
           text: "Refresh"
-          onClicked: py.hamster_lib.current()
+          onClicked: py.hamster_lib.refreshCurrent()
         }
       }
     }
@@ -193,21 +208,16 @@ Item {
   Timer {
     id: currentTimer
     interval: 1000
-    running : false
+    running : currentFact != null
     repeat  : true
-    onTriggered: {
-      py.hamster_lib.current()
-    }
+    onTriggered: updateCurrentText()
   }
 
   Connections {
     target: py.hamster_lib
     onCurrentUpdated: {
-      if(current != null) {
-        textFieldCurrent.text = Qt.formatDateTime(current.start(), "hh:mm") + " " + current.activity() + "@" + current.category() + " " + current.description() + " (" + Qt.formatTime(current.duration(), "hh:mm") + ")"
-      } else {
-        textFieldCurrent.text = ""
-      }
+      currentFact = current
+      updateCurrentText()
     }
     onErrorMessage   : {
       labelErrorPopup.text = message
@@ -78,6 +78,20 @@ Item {
             onCurrentDateChanged: sortFilterModel.endDate = currentDate
           }
         }
+        ColumnLayout {
+          Label {
+            text: "Search"
+            font: labelStart_.font
+            color: labelStart_.color
+          }
+          /* Only show the facts of the days that match the search. */
+          TextField {
+            id: textSearch_
+            placeholderText: "<words>"
+            selectByMouse: true
+            onTextChanged: sortFilterModel.query = text
+          }
+        }
 
         Rectangle {
           Layout.fillWidth: true
@@ -128,12 +142,15 @@ Item {
         startDate  : new Date()
         endDate    : new Date()
         sourceModel: py.fact_model
+        /* The start date moves back when older facts are shown. */
+        onStartDateChanged: timeEditStart.currentDate = startDate
       }
 
       FactView {
         id: tableViewToday
         anchors.fill: parent
         model: sortFilterModel
+        pagesOlder: true
       }
     }
   }
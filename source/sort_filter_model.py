@@ -19,27 +19,59 @@
 ############################################################################
 
 import sys
-from PyQt5.QtCore import Qt, QObject, QSortFilterProxyModel, QDate, QModelIndex, QVariant, QAbstractItemModel
+from PyQt5.QtCore import Qt, QObject, QAbstractProxyModel, QDate, QModelIndex, QVariant, QAbstractItemModel
 from PyQt5.QtCore import pyqtProperty, pyqtSignal, pyqtSlot
 
-class SortFilterModelPyQt(QSortFilterProxyModel):
-    """ The Sort and Filter Proxy model"""
+from fact_columns import dateToDay
+from instrumentation import instrumented
+
+class SortFilterModelPyQt(QAbstractProxyModel):
+    """ The Sort and Filter Proxy model
+
+    The model shows the facts of the source model for the days from the start
+    date up to and including the end date. The source model must keep its facts
+    in FactColumns, in the order of their start times, see FactModelPyQt.
+    The facts of the days are then a single range of source rows that is found
+    with a binary search, the rows do not have to be filtered or sorted.
+
+    If a query is set only the facts that match it are shown. The facts are
+    found by the full-text search of the storage, see HamsterBackend.search(),
+    the days of the matching facts are loaded by the source model and their
+    rows are then looked up by key.
+
+    If the facts of the source model overlap their days are not in order, see
+    FactColumns.ordered. The rows in the range are then filtered by day, like
+    the rows of the facts that match a query.
+    """
 
     startDateChanged = pyqtSignal(QDate, name='startDateChanged', arguments=['startDate'])
     endDateChanged   = pyqtSignal(QDate, name='endDateChanged', arguments=['endDate'])
+    queryChanged     = pyqtSignal(str, name='queryChanged', arguments=['query'])
 
     def __init__(self, hamster):
         super(SortFilterModelPyQt, self).__init__()
         self._startDate = QDate()
         self._endDate   = QDate()
-        self._dayRole   = 0
-        self._startRole = 0
-
-        self.dynamicSortFilter  = True
+        self._columns   = None # Columns of the source model
+        self._startDay  = None
+        self._endDay    = None
+        self._first     = 0    # The range of source rows shown, the end is
+        self._end       = 0    # the row after the last row shown.
+        self._removing  = False
+        self._fetching  = False # Is the start of an older page being looked up?
+        self._resetting = False
+        self._query     = ''
+        self._searchId = 0    # Identifies the last search that was started
+        self._keys      = None # The keys of the facts that match the query
+        self._rows      = None # The source rows shown if there is a query,
+        self._proxyRows = {}   # and the rows of this model by source row.
 
-        self.startDateChanged.connect(self.invalidateFilter)
-        self.endDateChanged.connect(self.invalidateFilter)
-        self.sourceModelChanged.connect(self._updateDateRoles)
+        self.startDateChanged.connect(self._ensureLoaded)
+        self.startDateChanged.connect(self._updateDays)
+        self.endDateChanged.connect(self._updateDays)
+        self.startDateChanged.connect(self._search)
+        self.endDateChanged.connect(self._search)
+        self.queryChanged.connect(self._search)
 
     @pyqtProperty(QAbstractItemModel)
     def sourceModel(self):
@@ -47,7 +79,36 @@ class SortFilterModelPyQt(QSortFilterProxyModel):
 
     @sourceModel.setter
     def sourceModel(self, model):
+        self.setSourceModel(model)
+
+    def setSourceModel(self, model):
+        old = super(SortFilterModelPyQt, self).sourceModel()
+        if old is not None:
+            old.modelAboutToBeReset.disconnect(self._sourceAboutToBeReset)
+            old.modelReset.disconnect(self._sourceReset)
+            old.rowsInserted.disconnect(self._sourceRowsInserted)
+            old.rowsAboutToBeRemoved.disconnect(self._sourceRowsAboutToBeRemoved)
+            old.rowsRemoved.disconnect(self._sourceRowsRemoved)
+            old.dataChanged.disconnect(self._sourceDataChanged)
+            old.layoutChanged.disconnect(self._reset)
+            old.rowsMoved.disconnect(self._reset)
+        self.beginResetModel()
         super(SortFilterModelPyQt, self).setSourceModel(model)
+        self._columns = model.columns() if model is not None else None
+        self._keys    = None
+        self._updateRows()
+        if model is not None:
+            model.modelAboutToBeReset.connect(self._sourceAboutToBeReset)
+            model.modelReset.connect(self._sourceReset)
+            model.rowsInserted.connect(self._sourceRowsInserted)
+            model.rowsAboutToBeRemoved.connect(self._sourceRowsAboutToBeRemoved)
+            model.rowsRemoved.connect(self._sourceRowsRemoved)
+            model.dataChanged.connect(self._sourceDataChanged)
+            model.layoutChanged.connect(self._reset)
+            model.rowsMoved.connect(self._reset)
+        self.endResetModel()
+        self._ensureLoaded()
+        self._search()
 
     @pyqtProperty(QDate, notify=startDateChanged)
     def startDate(self):
@@ -69,33 +130,251 @@ class SortFilterModelPyQt(QSortFilterProxyModel):
             self._endDate = endDate
             self.endDateChanged.emit(endDate)
 
-    @pyqtSlot(int, QModelIndex, result=bool)
-    def filterAcceptsRow(self, row, parentIndex):
-        index = self.sourceModel.index(row, 0, parentIndex)
-        if not index.isValid():
+    @pyqtProperty(str, notify=queryChanged)
+    def query(self):
+        """ Only the facts that match the query are shown if it is not empty,
+        see HamsterBackend.search(). """
+        return self._query
+
+    @query.setter
+    def query(self, query):
+        if query != self._query:
+            self._query = query
+            self.queryChanged.emit(query)
+
+    @pyqtSlot()
+    def _search(self):
+        # Search the facts that match the query, the rows are updated when the
+        # result arrives. Results of earlier searches are ignored.
+        self._searchId += 1
+        model = self.sourceModel
+        if not self._query.strip() or model is None or not hasattr(model, 'search'):
+            if self._keys is not None:
+                self._keys = None
+                self._reset()
+            return
+        searchId = self._searchId
+        model.search(self._query, self._startDate, self._endDate,
+                     lambda result: self._searched(searchId, result))
+
+    def _searched(self, searchId, result):
+        if searchId != self._searchId:
+            return
+        self._keys, first = result
+        # The facts that match must be loaded to be shown.
+        model = self.sourceModel
+        if first is not None and hasattr(model, 'ensureLoaded'):
+            model.ensureLoaded(QDate(first))
+        self._reset()
+
+    def _rowList(self):
+        # Are the rows shown a list of rows instead of the range of rows?
+        return self._keys is not None or (self._columns is not None and not self._columns.ordered)
+
+    def _showsDay(self, day):
+        return ((self._startDay is None or day >= self._startDay) and
+                (self._endDay is None or day <= self._endDay))
+
+    def _updateRows(self):
+        # Update the source rows shown: the range of rows of the days, and the
+        # rows in the range of the facts that match if there is a query or of
+        # the days if the days are not in order.
+        self._first, self._end = self._dayRows()
+        if not self._rowList():
+            self._rows      = None
+            self._proxyRows = {}
+            return
+        rows = range(self._first, self._end)
+        if self._keys is not None:
+            rows = [row for row in self.sourceModel.keyRows(self._keys) if self._first <= row < self._end]
+        if not self._columns.ordered:
+            days = self._columns.days
+            rows = [row for row in rows if self._showsDay(days[row])]
+        self._rows      = list(rows)
+        self._proxyRows = { row: index for index, row in enumerate(self._rows) }
+
+    def _dayRows(self):
+        # The range of source rows for the days shown.
+        if self._columns is None:
+            return (0, 0)
+        return self._columns.dayRows(self._startDay, self._endDay)
+
+    @pyqtSlot()
+    def _updateDays(self):
+        # The day numbers of the start and end dates, used to search the columns.
+        # Without a start date all the loaded facts up to the end date are
+        # shown, older facts are loaded as pages using fetchOlder().
+        self._startDay = dateToDay(self._startDate) if self._startDate.isValid() else None
+        self._endDay   = dateToDay(self._endDate) if self._endDate.isValid() else None
+        self._reset()
+
+    @pyqtSlot()
+    @instrumented
+    def _reset(self):
+        self.beginResetModel()
+        self._updateRows()
+        self.endResetModel()
+
+    @pyqtSlot()
+    def _sourceAboutToBeReset(self):
+        self.beginResetModel()
+
+    @pyqtSlot()
+    def _sourceReset(self):
+        self._updateRows()
+        self.endResetModel()
+
+    @pyqtSlot(QModelIndex, int, int)
+    @instrumented
+    def _sourceRowsInserted(self, parent, first, last):
+        if self._rows is not None or self._rowList():
+            # The rows of the facts that match moved, and the facts that
+            # were inserted could match.
+            self._reset()
+            if self._keys is not None:
+                self._search()
+            return
+        # The days of the rows that were shown did not change, only the
+        # inserted rows that are in the new range of rows are added.
+        newFirst, newEnd = self._dayRows()
+        shownFirst = max(first, newFirst)
+        shownLast  = min(last, newEnd - 1)
+        if shownFirst > shownLast:
+            self._first, self._end = newFirst, newEnd
+            return
+        self.beginInsertRows(QModelIndex(), shownFirst - newFirst, shownLast - newFirst)
+        self._first, self._end = newFirst, newEnd
+        self.endInsertRows()
+
+    @pyqtSlot(QModelIndex, int, int)
+    @instrumented
+    def _sourceRowsAboutToBeRemoved(self, parent, first, last):
+        if self._rows is not None:
+            self._resetting = True
+            self.beginResetModel()
+            return
+        shownFirst = max(first, self._first)
+        shownLast  = min(last, self._end - 1)
+        self._removing = shownFirst <= shownLast
+        if self._removing:
+            self.beginRemoveRows(QModelIndex(), shownFirst - self._first, shownLast - self._first)
+
+    @pyqtSlot(QModelIndex, int, int)
+    @instrumented
+    def _sourceRowsRemoved(self, parent, first, last):
+        if self._resetting:
+            self._resetting = False
+            self._updateRows()
+            self.endResetModel()
+            return
+        self._first, self._end = self._dayRows()
+        if self._removing:
+            self._removing = False
+            self.endRemoveRows()
+
+    @instrumented
+    def _sourceDataChanged(self, topLeft, bottomRight, roles = []):
+        if self._rows is not None or self._rowList():
+            # The facts that changed could match or no longer match.
+            self._reset()
+            if self._keys is not None:
+                self._search()
+            return
+        newFirst, newEnd = self._dayRows()
+        if (newFirst, newEnd) != (self._first, self._end):
+            # The day of a fact at the edge of the range changed.
+            self._reset()
+            return
+        first = max(topLeft.row(), self._first)
+        last  = min(bottomRight.row(), self._end - 1)
+        if first <= last:
+            self.dataChanged.emit(self.index(first - self._first, topLeft.column()),
+                                  self.index(last - self._first, bottomRight.column()), roles)
+
+    @instrumented
+    def index(self, row, column, parent=QModelIndex()):
+        if parent.isValid() or row < 0 or row >= self.rowCount() or column < 0 or column >= self.columnCount():
+            return QModelIndex()
+        return self.createIndex(row, column)
+
+    def parent(self, index=QModelIndex()):
+        return QModelIndex()
+
+    @instrumented
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        if self._rows is not None:
+            return len(self._rows)
+        return self._end - self._first
+
+    def columnCount(self, parent=QModelIndex()):
+        if parent.isValid() or self.sourceModel is None:
+            return 0
+        return self.sourceModel.columnCount()
+
+    @instrumented
+    def mapToSource(self, index):
+        if not index.isValid() or self.sourceModel is None:
+            return QModelIndex()
+        if self._rows is not None:
+            return self.sourceModel.index(self._rows[index.row()], index.column())
+        return self.sourceModel.index(self._first + index.row(), index.column())
+
+    @instrumented
+    def mapFromSource(self, sourceIndex):
+        if not sourceIndex.isValid():
+            return QModelIndex()
+        row = sourceIndex.row()
+        if self._rows is not None:
+            row = self._proxyRows.get(row)
+            return self.index(row, sourceIndex.column()) if row is not None else QModelIndex()
+        if row < self._first or row >= self._end:
+            return QModelIndex()
+        return self.index(row - self._first, sourceIndex.column())
+
+    @pyqtSlot()
+    def _ensureLoaded(self):
+        # The source model only loads the days that are requested, make sure
+        # that the days shown by this model are loaded.
+        model = self.sourceModel
+        if model is not None and hasattr(model, 'ensureLoaded'):
+            model.ensureLoaded(self._startDate)
+
+    def canFetchMore(self, parent):
+        # Views only page the source model if there is no start date, with
+        # a start date fetchOlder() moves the start date instead.
+        if self._startDate.isValid():
             return False
-        day = self.sourceModel.data(index, self._dayRole)
-        if self._startDate == self._endDate:
-            return (day == self._startDate)
-        # Check if the day is in between the start and end.
-        if (day >= self._startDate) and (day <= self._endDate):
-            return True
-        return False
+        return super(SortFilterModelPyQt, self).canFetchMore(parent)
 
     @pyqtSlot()
-    def _updateDateRoles(self):
-        dictionary  = dict(self.roleNames())
-        for role, name in dictionary.items():
-            if name == 'day':
-                  self._dayRole = role
-            elif name == 'start':
-                  self._startRole = role
-                  self.setSortRole(self._startRole)
-                  self.invalidate()
-                  self.sort(0, Qt.AscendingOrder )
+    def fetchOlder(self):
+        """ Show the next page of older facts.
 
+        Without a start date the source model loads its next page of facts.
+        With a start date, the start date is moved back to the first day of
+        the page of facts before it, the source model then loads those days.
+        Views call it only if they page older facts, see FactView.pagesOlder.
+        """
+        if not self._startDate.isValid():
+            if self.canFetchMore(QModelIndex()):
+                self.fetchMore(QModelIndex())
+            return
+        model = self.sourceModel
+        if self._fetching or model is None or not hasattr(model, 'pageStart'):
+            return
+        self._fetching = True
+        before = self._startDate
+        def found(day):
+            self._fetching = False
+            # Skip the page if the start date was changed in the mean time.
+            if day.isValid() and self._startDate == before:
+                self.startDate = day
+        model.pageStart(before, found)
 
     @pyqtSlot(int, result='QVariant')
+    @instrumented
     def get(self, row):
         dictionary  = dict(self.roleNames())
         headers = {}
@@ -103,11 +382,3 @@ class SortFilterModelPyQt(QSortFilterProxyModel):
         for role, name in dictionary.items():
             headers[str(name, "utf-8")] = self.data(index, role)
         return headers
-
-    @pyqtSlot(QModelIndex, QModelIndex, result=bool)
-    def lessThan(self, left, right):
-        leftStart  = self.sourceModel.data(left, self._startRole)
-        rightStart = self.sourceModel.data(right, self._startRole)
-        return (leftStart < rightStart)
-
-
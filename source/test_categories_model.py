@@ -0,0 +1,64 @@
+##########################################################################
+##
+## Copyright (c) 2017 Carel Combrink
+##
+## This file is part of the Hamster QML GUI, a QML GUI for the hamster-lib.
+##
+## The Hamster QML GUI is free software: you can redistribute it and/or
+## modify it under the terms of the GNU Lesser General Public License as
+## published by the Free Software Foundation, either version 3 of the
+## License, or (at your option) any later version.
+##
+## The Hamster QML GUI is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU Lesser General Public License for more details.
+##
+## You should have received a copy of the GNU Lesser General Public License
+## along with the Hamster QML GUI. If not, see <http://www.gnu.org/licenses/>.
+############################################################################
+"""
+Tests of the incremental updates of the HqCategoriesModel. Run with python -m
+unittest in the source folder.
+"""
+import datetime
+import tempfile
+import unittest
+
+from PyQt5.QtCore import QDateTime
+
+from test_fact_journal import makeConfig
+from hamster_pyqt      import HamsterPyQt
+from categories_model  import HqCategoriesModel
+
+class TestCategoriesModel(unittest.TestCase):
+
+    def setUp(self):
+        self._folder  = tempfile.TemporaryDirectory()
+        self._hamster = HamsterPyQt(threaded=False, config=makeConfig(self._folder.name))
+
+    def tearDown(self):
+        self._hamster.close()
+        self._folder.cleanup()
+
+    def tree(self, model):
+        """ The names of the categories with the names of their activities. """
+        root = model.invisibleRootItem()
+        return { root.child(row).text(): sorted(root.child(row).child(child).text()
+                                                for child in range(root.child(row).rowCount()))
+                 for row in range(root.rowCount()) }
+
+    def test_update_creates_activity(self):
+        added = []
+        self._hamster.factAdded.connect(added.append)
+        start = QDateTime(datetime.datetime(2020, 1, 1, 10, 0))
+        self._hamster.create(start, start.addSecs(3600), 'act', 'cat', '')
+        model = HqCategoriesModel(self._hamster)
+        self.assertEqual(self.tree(model), { '(uncategorised)': [], 'cat': ['act'] })
+
+        fact = added[0]
+        self._hamster.updateFact(fact.key(), fact.start(), fact.end(), 'other', 'new', '')
+        self.assertEqual(self.tree(model), { '(uncategorised)': [], 'cat': ['act'], 'new': ['other'] })
+
+if __name__ == '__main__':
+    unittest.main()
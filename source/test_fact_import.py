@@ -0,0 +1,41 @@
+##########################################################################
+##
+## Copyright (c) 2017 Carel Combrink
+##
+## This file is part of the Hamster QML GUI, a QML GUI for the hamster-lib.
+##
+## The Hamster QML GUI is free software: you can redistribute it and/or
+## modify it under the terms of the GNU Lesser General Public License as
+## published by the Free Software Foundation, either version 3 of the
+## License, or (at your option) any later version.
+##
+## The Hamster QML GUI is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU Lesser General Public License for more details.
+##
+## You should have received a copy of the GNU Lesser General Public License
+## along with the Hamster QML GUI. If not, see <http://www.gnu.org/licenses/>.
+############################################################################
+"""
+Tests of reading the facts to import. Run with python -m unittest in the
+source folder.
+"""
+import datetime
+import unittest
+
+from fact_import import readHamster
+
+class TestReadHamster(unittest.TestCase):
+
+    def test_comma_starts_description(self):
+        # A comma without an @ starts the description, as when a fact is started.
+        records = list(readHamster(['2020-01-01 10:00 - 2020-01-01 11:00 act, some text',
+                                    '2020-01-01 12:00 - 2020-01-01 13:00 act@cat, more text']))
+        self.assertEqual(records, [
+            (datetime.datetime(2020, 1, 1, 10), datetime.datetime(2020, 1, 1, 11), 'act', '', 'some text'),
+            (datetime.datetime(2020, 1, 1, 12), datetime.datetime(2020, 1, 1, 13), 'act', 'cat', 'more text'),
+        ])
+
+if __name__ == '__main__':
+    unittest.main()
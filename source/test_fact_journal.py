@@ -0,0 +1,81 @@
+##########################################################################
+##
+## Copyright (c) 2017 Carel Combrink
+##
+## This file is part of the Hamster QML GUI, a QML GUI for the hamster-lib.
+##
+## The Hamster QML GUI is free software: you can redistribute it and/or
+## modify it under the terms of the GNU Lesser General Public License as
+## published by the Free Software Foundation, either version 3 of the
+## License, or (at your option) any later version.
+##
+## The Hamster QML GUI is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU Lesser General Public License for more details.
+##
+## You should have received a copy of the GNU Lesser General Public License
+## along with the Hamster QML GUI. If not, see <http://www.gnu.org/licenses/>.
+############################################################################
+"""
+Tests of replaying the FactJournal. Run with python -m unittest in the source folder.
+"""
+import os
+import datetime
+import tempfile
+import unittest
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt5.QtCore import QCoreApplication
+
+from hamster_pyqt import HamsterPyQt, HamsterConfig
+
+app = QCoreApplication.instance() or QCoreApplication([])
+
+def makeConfig(folder):
+    """ The configuration of a database in the given folder, without the
+    environment. """
+    path = os.path.join(folder, 'hamster.conf')
+    with open(path, 'w') as file:
+        file.write('[hamster]\n')
+        for key, name in (('db_path', 'hamster.sqlite'), ('tmpfile_path', 'hamster.fact'),
+                          ('journal_path', 'hamster.journal')):
+            file.write('{0} = {1}\n'.format(key, os.path.join(folder, name)))
+    return HamsterConfig(path, environ={})
+
+class TestJournalReplay(unittest.TestCase):
+
+    def setUp(self):
+        self._folder = tempfile.TemporaryDirectory()
+        self._config = makeConfig(self._folder.name)
+
+    def tearDown(self):
+        self._folder.cleanup()
+
+    def open(self, errors):
+        hamster = HamsterPyQt(threaded=False, config=self._config)
+        hamster.errorMessage.connect(errors.append)
+        return hamster
+
+    def test_replay_without_done_markers(self):
+        # The application stops after the start and the stop were applied,
+        # before they were marked as done.
+        errors  = []
+        hamster = self.open(errors)
+        hamster._journal.done = lambda id: None
+        hamster.start('2020-01-01 10:00 act@cat')
+        hamster.stop(datetime.datetime(2020, 1, 1, 11, 0))
+        hamster.close()
+        self.assertEqual(len(hamster._journal.pending()), 2)
+
+        hamster = self.open(errors)
+        backend = hamster._worker._backend
+        self.assertIsNone(backend.tmpFact())
+        self.assertEqual(len(backend.control.facts.get_all()), 1)
+        self.assertEqual(hamster._journal.pending(), [])
+        self.assertEqual(errors, [])
+        hamster.close()
+
+if __name__ == '__main__':
+    unittest.main()